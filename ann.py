@@ -0,0 +1,179 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kollybistes')
+
+NEURON_RE = re.compile(r'^\s*l(\d+)_(\d+)\s*=\s*PineActivationFunction(Linear|Tanh)\((.*)\)\s*$')
+TERM_RE = re.compile(r'l(\d+)_(\d+)\s*\*\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)')
+THRESHOLD_RE = re.compile(r'^\s*threshold\s*=\s*input\(.*defval\s*=\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)')
+
+# Input masks load() applies to Pine scripts by model name. The hand-written
+# ANNStrategy._tick never assigned l0[2] and l0[3] of ann_strategy.pine, and the
+# live strategy keeps trading on that; feeding all 15 inputs is a separate change.
+INPUT_MASKS = {
+  'ann_strategy': [1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+}
+
+class ANNModel(object):
+  """ Batch evaluator of the strategy network
+
+  Every input neuron is fed the same value, the relative VWAP change of a bar,
+  times its entry in inputs (0 for a neuron that is never set), so predict()
+  takes a 1-d array of changes and returns the output neuron for each of them. layers holds one weight matrix per tanh layer, one row per
+  neuron of the layer and one column per neuron of the previous layer.
+
+  """
+
+  def __init__(self, layers, inputs=None, threshold=None, name=None):
+    self.layers = [np.asarray(l, dtype=np.float64) for l in layers]
+    if inputs is None:
+      inputs = np.ones(self.layers[0].shape[1])
+    self.inputs = np.asarray(inputs, dtype=np.float64)
+    self.threshold = threshold
+    self.name = name
+
+  def predict(self, diffs):
+    x = np.asarray(diffs, dtype=np.float64)[:, np.newaxis] * self.inputs
+    # np.tanh saturates instead of overflowing like the exp() formula
+    for layer in self.layers:
+      x = np.tanh(x @ layer.T)
+    return x[:, 0]
+
+  def save(self, path):
+    arrays = dict(('layer_%d' % i, layer) for i, layer in enumerate(self.layers))
+    threshold = np.nan if self.threshold is None else self.threshold
+    with open(path, 'wb') as f:
+      np.savez(f, inputs=self.inputs, threshold=threshold, **arrays)
+
+  @classmethod
+  def load_npz(cls, path, name=None):
+    with np.load(path) as data:
+      layers = [data['layer_%d' % i] for i in range(len(data.files) - 2)]
+      threshold = float(data['threshold'])
+      inputs = data['inputs']
+    if np.isnan(threshold):
+      threshold = None
+    return cls(layers, inputs, threshold, name)
+
+def parse_pine(text, name=None):
+  """ Builds a model from the l0_*, l1_*, ... neuron definitions of a Pine script """
+  inputs = {}
+  neurons = {}
+  threshold = None
+
+  for line in text.splitlines():
+    m = THRESHOLD_RE.match(line)
+    if m:
+      threshold = float(m.group(1))
+      continue
+
+    m = NEURON_RE.match(line)
+    if not m:
+      continue
+    layer, neuron, activation, expr = int(m.group(1)), int(m.group(2)), m.group(3), m.group(4)
+
+    if layer == 0:
+      if activation != 'Linear':
+        raise ValueError("l0_%d: input neurons must be linear" % neuron)
+      inputs[neuron] = 1.0
+      continue
+
+    if activation != 'Tanh':
+      raise ValueError("l%d_%d: hidden neurons must be tanh" % (layer, neuron))
+    weights = {}
+    for src_layer, src_neuron, weight in TERM_RE.findall(expr):
+      if int(src_layer) != layer - 1:
+        raise ValueError("l%d_%d: refers to layer %s" % (layer, neuron, src_layer))
+      weights[int(src_neuron)] = float(weight)
+    neurons.setdefault(layer, {})[neuron] = weights
+
+  if not inputs or not neurons:
+    raise ValueError("no network found")
+
+  layers = []
+  width = max(inputs) + 1
+  for layer in range(1, max(neurons) + 1):
+    rows = neurons.get(layer)
+    if rows is None:
+      raise ValueError("layer %d is missing" % layer)
+    matrix = np.zeros((max(rows) + 1, width))
+    for neuron, weights in rows.items():
+      for src, weight in weights.items():
+        matrix[neuron, src] = weight
+    layers.append(matrix)
+    width = matrix.shape[0]
+
+  model_inputs = np.zeros(max(inputs) + 1)
+  model_inputs[list(inputs)] = 1.0
+  return ANNModel(layers, model_inputs, threshold, name)
+
+def load(path, cache_dir=CACHE_DIR, inputs=None):
+  """ Loads a model from a Pine script or an .npz file
+
+  Parsed Pine scripts are cached as .npz files keyed by the hash of the
+  script, so the text is only parsed again when it changes. inputs is a mask
+  of the input neurons to feed, by default INPUT_MASKS for Pine scripts and
+  the saved one for .npz files.
+
+  """
+  name = os.path.splitext(os.path.basename(path))[0]
+  if path.endswith('.npz'):
+    return _masked(ANNModel.load_npz(path, name), inputs)
+  if inputs is None:
+    inputs = INPUT_MASKS.get(name)
+
+  with open(path, 'rb') as f:
+    source = f.read()
+
+  cached = None
+  if cache_dir is not None:
+    digest = hashlib.sha1(source).hexdigest()
+    cached = os.path.join(cache_dir, '%s-%s.npz' % (name, digest[:16]))
+    if os.path.exists(cached):
+      return _masked(ANNModel.load_npz(cached, name), inputs)
+
+  model = parse_pine(source.decode(), name)
+
+  if cached is not None:
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name so concurrent loaders never see a partial file
+    tmp = '%s.%d.tmp' % (cached, os.getpid())
+    model.save(tmp)
+    os.replace(tmp, cached)
+
+  return _masked(model, inputs)
+
+def _masked(model, inputs):
+  if inputs is None:
+    return model
+  inputs = np.asarray(inputs, dtype=np.float64)
+  if inputs.shape != model.inputs.shape:
+    raise ValueError("%s: %d inputs, the model has %d" % (model.name, len(inputs), len(model.inputs)))
+  model.inputs = inputs
+  return model
+
+def diffs(vwap):
+  """ Relative change of each VWAP against the next one, for newest first series """
+  vwap = np.asarray(vwap, dtype=np.float64)
+  return (vwap[:-1] - vwap[1:]) / vwap[1:]
+
+def positions(predictions, threshold, buying=False):
+  """ Replays the buying state machine over the predictions
+
+  Goes long above threshold, short below -threshold and keeps the previous
+  state in between (or the given initial state before the first decision).
+  NaN predictions keep the state too. 2-d predictions are replayed row by row.
+
+  """
+  predictions = np.asarray(predictions, dtype=np.float64)
+  long = predictions > threshold
+  decided = long | (predictions < -threshold)
+
+  # index of the last decision at or before each bar
+  last = np.where(decided, np.arange(predictions.shape[-1]), -1)
+  np.maximum.accumulate(last, axis=-1, out=last)
+
+  return np.where(last >= 0, np.take_along_axis(long, np.maximum(last, 0), axis=-1), buying)
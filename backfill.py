@@ -0,0 +1,170 @@
+""" Reconstructs missing OHLC history from Kraken's public Trades endpoint
+
+The OHLC endpoint only returns the latest 720 bars, so any downtime of the
+synchronizer leaves gaps. Backfiller finds them from the stored timestamps,
+pages through the trades of each gap with the since cursor -- several ranges
+concurrently, within the API's rate limit -- aggregates them into bars and
+stores those through the synchronizer, rollups and listeners included.
+
+"""
+
+import concurrent.futures
+import datetime
+import time
+
+import numpy as np
+
+from ohlc import OHLC
+
+RATE_LIMITED = 'EAPI:Rate limit exceeded'
+
+class TradeAggregator(object):
+  """ Streams trades into interval minute bars, keeping only the open bar in memory
+
+  Bars are rows in the format of the OHLC endpoint:
+  [time, open, high, low, close, vwap, volume, count].
+
+  """
+
+  def __init__(self, interval):
+    self.step = interval * 60
+    self.bar = None
+    self.notional = 0.0
+
+  def add(self, price, volume, timestamp):
+    """ Adds a trade, returns the bar it closed or None """
+    bucket = int(timestamp) // self.step * self.step
+    closed = None
+    if self.bar is not None and bucket != self.bar[0]:
+      closed = self.flush()
+
+    if self.bar is None:
+      self.bar = [bucket, price, price, price, price, 0.0, 0.0, 0]
+      self.notional = 0.0
+
+    bar = self.bar
+    if price > bar[2]:
+      bar[2] = price
+    if price < bar[3]:
+      bar[3] = price
+    bar[4] = price
+    bar[6] += volume
+    bar[7] += 1
+    self.notional += price * volume
+    return closed
+
+  def flush(self):
+    """ Closes and returns the open bar, or None """
+    bar = self.bar
+    if bar is None:
+      return None
+    bar[5] = self.notional / bar[6] if bar[6] > 0 else bar[4]
+    self.bar = None
+    return bar
+
+class Backfiller(object):
+
+  def __init__(self, syncer, chunk=datetime.timedelta(days=1), retry_delay=5.0):
+    """ syncer is the TradeHistorySynchronizer whose API, interval and storage are used """
+    self.syncer = syncer
+    self.interval = syncer.interval
+    self.chunk = int(chunk.total_seconds())
+    self.retry_delay = retry_delay
+
+  def gaps(self, session, pair, since=None):
+    """ Missing [start, end) ranges of pair in epoch seconds, from since if given """
+    step = self.interval * 60
+    timestamps = self._timestamps(session, pair, since)
+
+    gaps = []
+    if since is not None:
+      first = int(since.timestamp()) // step * step
+      if len(timestamps) == 0:
+        gaps.append((first, int(time.time()) // step * step))
+      elif timestamps[0] > first:
+        gaps.append((first, int(timestamps[0])))
+
+    holes = np.flatnonzero(np.diff(timestamps) > step)
+    for i in holes:
+      gaps.append((int(timestamps[i]) + step, int(timestamps[i + 1])))
+    return gaps
+
+  def _timestamps(self, session, pair, since):
+    if self.syncer.store is not None:
+      epoch = None if since is None else int(since.timestamp())
+      return self.syncer.store.load(session, pair, self.interval, epoch).timestamp
+
+    query = session.query(OHLC.timestamp).filter(OHLC.pair == pair)
+    if since is not None:
+      query = query.filter(OHLC.timestamp >= since)
+    return np.array([int(row[0].timestamp()) for row in query.order_by(OHLC.timestamp)], dtype=np.int64)
+
+  def backfill(self, session, pair, since=None):
+    """ Fills the gaps of pair, returns the number of bars stored """
+    ranges = []
+    for start, end in self.gaps(session, pair, since):
+      for chunk_start in range(start, end, self.chunk):
+        ranges.append((chunk_start, min(chunk_start + self.chunk, end)))
+
+    stored = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.syncer.workers) as executor:
+      for name, rows in executor.map(lambda r: self.fetch_range(pair, *r), ranges):
+        if not rows:
+          continue
+        stored += len(rows)
+        self.store(session, name, rows)
+    return stored
+
+  def store(self, session, name, rows):
+    last = rows[-1][0]
+    if self.syncer.store is not None:
+      new_records, existing_records, updated_records, changed = self.syncer._upsert_compact(name, rows, session)
+    else:
+      new_records, existing_records, updated_records, changed = self.syncer._upsert_models(name, rows, last, session)
+    session.commit()
+    print("%s backfilled %s - %s: %d new records, %d existing records, %d updated records" %
+          (name, datetime.datetime.fromtimestamp(rows[0][0]), datetime.datetime.fromtimestamp(last),
+           new_records, existing_records, updated_records))
+    for listener in self.syncer.listeners:
+      listener.on_bars(name, changed)
+
+  def fetch_range(self, pair, start, end):
+    """ Aggregates the trades in [start, end) into bars, returns (Kraken's pair name, bar rows) """
+    aggregator = TradeAggregator(self.interval)
+    rows = []
+    name = pair
+    since = str(start)
+
+    while True:
+      result = self.syncer.api.query_public('Trades', {'pair': pair, 'since': since})
+      if result.get('error'):
+        if RATE_LIMITED in result['error']:
+          time.sleep(self.retry_delay)
+          continue
+        raise Exception(result['error'])
+
+      trades = []
+      for k, v in result['result'].items():
+        if k != 'last':
+          name, trades = k, v
+
+      done = not trades
+      for trade in trades:
+        timestamp = float(trade[2])
+        if timestamp < start:
+          continue
+        if timestamp >= end:
+          done = True
+          break
+        bar = aggregator.add(float(trade[0]), float(trade[1]), timestamp)
+        if bar is not None:
+          rows.append(bar)
+
+      if done or result['result']['last'] == since:
+        break
+      since = result['result']['last']
+
+    bar = aggregator.flush()
+    if bar is not None:
+      rows.append(bar)
+    return name, rows
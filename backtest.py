@@ -0,0 +1,130 @@
+""" Backtests of the ANN strategy and parallel parameter sweeps over them
+
+Bars come from a cache.ColumnCache, so the price data is memory mapped once
+and shared by the worker processes through the page cache instead of being
+queried again per job. Fill the cache first, e.g. with
+ColumnCache.fill(pair, interval, TradeHistory(...).bars()).
+
+"""
+
+import collections
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import ann
+import cache
+
+# Kraken's taker fee of the lowest volume tier
+DEFAULT_FEE = 0.0026
+
+Trade = collections.namedtuple('Trade', ('timestamp', 'position', 'price'))
+
+Result = collections.namedtuple('Result', ('pair', 'interval', 'threshold', 'model',
+                                           'total_return', 'max_drawdown', 'trades', 'exposure'))
+
+def predict(bars, model):
+  """ The model's output for every bar, from the VWAP change against the previous bar, oldest first """
+  predictions = np.full(len(bars), np.nan)
+  if len(bars) > 1:
+    vwap = np.asarray(bars.vwap)
+    predictions[1:] = model.predict((vwap[1:] - vwap[:-1]) / vwap[:-1])
+  return predictions
+
+def simulate(bars, predictions, threshold, fee=DEFAULT_FEE, short=False):
+  """ Trades the buying transitions of the predictions
+
+  The position decided at the close of a bar is held over the next one and
+  filled at that close, paying fee on the traded notional. Long while buying,
+  flat (or short, with short=True) otherwise.
+
+  Returns (equity curve, position per bar, indices of the bars that traded).
+
+  """
+  buying = ann.positions(predictions, threshold)
+  position = np.where(buying, 1.0, -1.0 if short else 0.0)
+  close = np.asarray(bars.close)
+
+  held = np.r_[0.0, position[:-1]]
+  turnover = np.abs(np.diff(np.r_[0.0, position]))
+  growth = np.ones(len(close))
+  growth[1:] = close[1:] / close[:-1]
+  returns = held * (growth - 1) - fee * turnover
+
+  return np.cumprod(1 + returns), position, np.flatnonzero(turnover)
+
+def max_drawdown(equity):
+  if len(equity) == 0:
+    return 0.0
+  return float(np.max(1 - equity / np.maximum.accumulate(equity)))
+
+def backtest(bars, model, threshold=None, fee=DEFAULT_FEE, short=False, predictions=None, trades=True):
+  """ Runs the strategy over bars, returns (Result, list of Trade or None) """
+  if threshold is None:
+    threshold = model.threshold
+  if predictions is None:
+    predictions = predict(bars, model)
+  equity, position, changes = simulate(bars, predictions, threshold, fee, short)
+
+  result = Result(None, None, threshold, model.name,
+                  float(equity[-1] - 1) if len(equity) else 0.0,
+                  max_drawdown(equity),
+                  len(changes),
+                  float(np.mean(position != 0)) if len(position) else 0.0)
+  if not trades:
+    return result, None
+  close = np.asarray(bars.close)
+  return result, [Trade(int(bars.timestamp[i]), float(position[i]), float(close[i])) for i in changes]
+
+def grid(pairs, intervals, thresholds, models):
+  """ All (pair, interval, threshold, model file) combinations """
+  return list(itertools.product(pairs, intervals, thresholds, models))
+
+# per worker state, set up by _init_worker
+_worker = {}
+
+def _init_worker(cache_root, since, fee, short):
+  _worker.clear()
+  _worker.update(cache=cache.ColumnCache(cache_root), since=since, fee=fee, short=short,
+                 bars={}, models={}, predictions={})
+
+def _run(job):
+  pair, interval, threshold, model_file = job
+
+  bars = _worker['bars'].get((pair, interval))
+  if bars is None:
+    bars = _worker['bars'][(pair, interval)] = _worker['cache'].history(pair, interval, _worker['since'])
+
+  model = _worker['models'].get(model_file)
+  if model is None:
+    model = _worker['models'][model_file] = ann.load(model_file)
+
+  # the predictions don't depend on the threshold, only compute them once
+  key = (pair, interval, model_file)
+  predictions = _worker['predictions'].get(key)
+  if predictions is None:
+    predictions = _worker['predictions'][key] = predict(bars, model)
+
+  result, _ = backtest(bars, model, threshold, _worker['fee'], _worker['short'], predictions, trades=False)
+  return result._replace(pair = pair, interval = interval, model = model_file)
+
+def sweep(jobs, cache_root, since=None, fee=DEFAULT_FEE, short=False, processes=None):
+  """ Backtests every (pair, interval, threshold, model file) job on a process pool
+
+  Jobs sharing bars and model are sent to the same worker in chunks so
+  resampling and inference run once per combination. Yields Results in the
+  order of the sorted jobs.
+
+  """
+  jobs = sorted(jobs, key=lambda job: (job[0], job[1], job[3], job[2]))
+  if not jobs:
+    return
+
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  chunksize = max(1, len(jobs) // (processes * 4))
+
+  with multiprocessing.Pool(processes, _init_worker, (cache_root, since, fee, short)) as pool:
+    for result in pool.imap(_run, jobs, chunksize):
+      yield result
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+""" End-to-end benchmarks of the sync and strategy hot paths, against a local replay.ReplayServer
+
+  ./bench.py [--sizes 1000 100000 10000000] [--db sqlite://] > bench_output.txt
+
+Times fetching and JSON decoding an OHLC response, building the models, the
+sync diff and its commit, compact schema upserts, resampling and ANN scoring
+at each size. The sync stages materialize ORM objects and an equally large
+JSON body, so they are only run up to --max-sync bars.
+
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from sqlalchemy.orm import sessionmaker
+
+import ann
+import compact
+import datastore
+import replay
+import series
+import v1
+
+PAIR = 'XBENCHZEUR'
+
+def timed(f, repeat=1):
+  """ Best wall time of repeat calls of f, and the result of the last one """
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+def bench_sync(bars, db):
+  response = replay.synthetic_ohlc(PAIR, bars)
+  server = replay.ReplayServer({'OHLC': [response]}).start()
+  try:
+    syncer = v1.TradeHistorySynchronizer([PAIR], 15, api_key='', rollups=())
+    syncer.api.conn = server.connection(size=1)
+    url = syncer.api.uri + '/' + syncer.api.apiversion + '/public/OHLC'
+
+    engine = datastore.create_engine(db)
+    datastore.Base.metadata.drop_all(engine)
+    datastore.init(engine)
+    session = sessionmaker(bind=engine)()
+
+    results = []
+    elapsed, body = timed(lambda: syncer.api.conn._request(url, {'pair': PAIR, 'interval': 15}))
+    results.append(('fetch', elapsed))
+    elapsed, decoded = timed(lambda: json.loads(body))
+    results.append(('json decode', elapsed))
+
+    rows = decoded['result'][PAIR]
+    last = decoded['result']['last']
+    elapsed, _ = timed(lambda: syncer._get_models(PAIR, rows, last, session))
+    results.append(('_get_models', elapsed))
+
+    # the first pass inserts everything, the second diffs against the stored rows
+    syncer._upsert_models(PAIR, rows, last, session)
+    elapsed, _ = timed(session.commit)
+    results.append(('commit', elapsed))
+    elapsed, _ = timed(lambda: syncer._upsert_models(PAIR, rows, last, session))
+    results.append(('sync diff', elapsed))
+
+    # the compact schema, inserting everything and then updating every bar
+    store = compact.CompactStore(15, rollups=())
+    bars = series.BarSeries(*zip(*rows))
+    elapsed, _ = timed(lambda: (store.upsert(session, PAIR, 15, bars), session.commit()))
+    results.append(('compact insert', elapsed))
+    columns = bars.columns()
+    moved = series.BarSeries(columns[0], *(column * 1.001 for column in columns[1:]))
+    elapsed, _ = timed(lambda: (store.upsert(session, PAIR, 15, moved), session.commit()))
+    results.append(('compact update', elapsed))
+
+    session.close()
+    engine.dispose()
+    return results
+  finally:
+    server.stop()
+
+def bench_strategy(bars, model, repeat):
+  rng = np.random.default_rng(0)
+  timestamp = 1500000000 + np.arange(bars, dtype=np.int64) * 900
+  price = 250 * np.exp(np.cumsum(rng.normal(0, 0.003, bars)))
+  base = series.BarSeries(timestamp, price, price, price, price, price, rng.exponential(500, bars), np.ones(bars))
+
+  results = []
+  elapsed, resampled = timed(lambda: series.resample(base, 240), repeat)
+  results.append(('resample 15->240', elapsed))
+  elapsed, predictions = timed(lambda: model.predict(ann.diffs(base.vwap[::-1])), repeat)
+  results.append(('ann predict', elapsed))
+  elapsed, _ = timed(lambda: ann.positions(predictions, model.threshold), repeat)
+  results.append(('ann positions', elapsed))
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 10000000])
+  parser.add_argument('--max-sync', type=int, default=100000, help="largest size the sync stages run at")
+  parser.add_argument('--db', default='sqlite://', help="database URL for the sync stages, it is wiped")
+  parser.add_argument('--model', default=v1.DEFAULT_MODEL)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  model = ann.load(args.model)
+
+  print("%-18s %10s %12s %14s" % ('stage', 'bars', 'seconds', 'bars/s'))
+  for bars in args.sizes:
+    results = bench_strategy(bars, model, args.repeat)
+    if bars <= args.max_sync:
+      results = bench_sync(bars, args.db) + results
+    for stage, elapsed in results:
+      print("%-18s %10d %12.6f %14.0f" % (stage, bars, elapsed, bars / elapsed if elapsed else float('inf')))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,228 @@
+""" Memory-mapped columnar bar cache for backtests
+
+Each pair and interval is a directory of raw little-endian column files,
+one per BarSeries field, opened with np.memmap so reading a history costs
+neither a database round trip nor heap proportional to its length.
+
+The column files live in a generation directory named by the CURRENT file
+next to it. The newest bar, the one Kraken still revises on every poll, is
+kept apart in tail.bin, replaced atomically. A poll revising it and adding
+later bars appends the bars that closed to the columns, value columns first
+and the timestamp column last, so readers (which take the row count from
+the timestamp column) only see complete rows, then swaps tail.bin. Changes
+to earlier rows -- backfilled gaps, late revisions -- write a new generation
+and swap CURRENT atomically; the columns a reader mapped are never modified.
+
+The synchronizer appends to it through listener(interval); fill() seeds it
+from an existing BarSeries, e.g. TradeHistory(...).bars().
+
+"""
+
+import os
+import re
+import shutil
+
+import numpy as np
+
+import series
+
+DTYPES = {
+  'timestamp': np.dtype('<i8'),
+  'count': np.dtype('<i8'),
+}
+DEFAULT_DTYPE = np.dtype('<f8')
+
+# the timestamp column is written last, its length is the number of complete rows
+WRITE_ORDER = [f for f in series.FIELDS if f != 'timestamp'] + ['timestamp']
+
+# one record of tail.bin
+TAIL_DTYPE = np.dtype([(field, DTYPES.get(field, DEFAULT_DTYPE)) for field in series.FIELDS])
+
+class ColumnCache(object):
+
+  def __init__(self, root):
+    self.root = root
+
+  def _dir(self, pair, interval):
+    return os.path.join(self.root, re.sub(r'[^A-Za-z0-9_.-]', '_', pair), str(int(interval)))
+
+  def _generation(self, pair, interval):
+    """ The directory holding the current column files of pair and interval, None if there is none """
+    base = self._dir(pair, interval)
+    try:
+      with open(os.path.join(base, 'CURRENT')) as f:
+        return os.path.join(base, f.read().strip())
+    except FileNotFoundError:
+      # written before generations, the files sit in the directory itself
+      if os.path.exists(os.path.join(base, 'timestamp.bin')):
+        return base
+      return None
+
+  def _path(self, generation, field):
+    return os.path.join(generation, field + '.bin')
+
+  def intervals(self, pair):
+    """ The intervals cached for pair """
+    path = os.path.dirname(self._dir(pair, 0))
+    if not os.path.isdir(path):
+      return []
+    return sorted(int(d) for d in os.listdir(path) if d.isdigit())
+
+  def open(self, pair, interval, since=None):
+    """ Cached bars of pair and interval from since (epoch seconds) as a BarSeries
+
+    The columns are memory maps, copied only if the tail bar is added.
+
+    """
+    # a rewrite can remove the generation between reading CURRENT and opening the files
+    for attempt in range(10):
+      generation = self._generation(pair, interval)
+      if generation is None:
+        return series.BarSeries.empty()
+      try:
+        # read before the columns, which only grow meanwhile
+        tail = self._tail(generation)
+        columns = self._columns(generation)
+      except FileNotFoundError:
+        continue
+      # the generation may have been swapped out and removed while it was read
+      if self._generation(pair, interval) != generation:
+        continue
+      # an append moves the tail bar into the columns before tail.bin is replaced
+      if len(columns):
+        tail = tail[tail.timestamp > columns.timestamp[-1]]
+      if since is not None:
+        columns = columns[int(np.searchsorted(columns.timestamp, since)):]
+        tail = tail[tail.timestamp >= since]
+      if len(tail) == 0:
+        return columns
+      return series.concat([columns, tail])
+    raise RuntimeError("%s/%d is rewritten faster than it can be opened" % (pair, interval))
+
+  def bars(self, pair, interval, since=None):
+    """ Cached bars of pair and interval from since (epoch seconds), copying at most the rows from since """
+    return self.open(pair, interval, since)
+
+  def history(self, pair, interval, since=None):
+    """ Bars of pair resampled to interval from the longest cached interval it is a multiple of """
+    cached = [i for i in self.intervals(pair) if interval % i == 0]
+    if not cached:
+      return series.BarSeries.empty()
+    bars = self.bars(pair, max(cached), since)
+    if max(cached) == interval:
+      return bars
+    return series.resample(bars, interval)
+
+  def _rows(self, generation):
+    path = self._path(generation, 'timestamp')
+    if not os.path.exists(path):
+      return 0
+    return os.path.getsize(path) // DTYPES['timestamp'].itemsize
+
+  def _columns(self, generation):
+    """ The column files of a generation as a BarSeries of memory maps """
+    rows = self._rows(generation)
+    if rows == 0:
+      return series.BarSeries.empty()
+    return series.BarSeries(*(np.memmap(self._path(generation, field), dtype=DTYPES.get(field, DEFAULT_DTYPE),
+                                        mode='r', shape=(rows,))
+                              for field in series.FIELDS))
+
+  def _tail(self, generation, after=None):
+    """ The bars of tail.bin after the given timestamp, empty if there is none """
+    try:
+      records = np.fromfile(self._path(generation, 'tail'), dtype=TAIL_DTYPE)
+    except FileNotFoundError:
+      return series.BarSeries.empty()
+    tail = series.BarSeries(*(records[field] for field in series.FIELDS))
+    if after is not None:
+      # an interrupted append can leave the previous tail bar in the columns too
+      tail = tail[tail.timestamp > after]
+    return tail
+
+  def fill(self, pair, interval, bars):
+    """ Writes bars into the cache
+
+    Bars from the tail bar on -- its revisions and later bars -- are appended,
+    changes to earlier rows (backfilled gaps, late revisions) rewrite the
+    columns into a new generation. Readers see either the old or the new
+    rows, and maps they hold don't change.
+
+    """
+    if len(bars) == 0:
+      return
+    if np.any(bars.timestamp[1:] <= bars.timestamp[:-1]):
+      order = np.argsort(bars.timestamp, kind='stable')
+      bars = bars[order]
+
+    generation = self._generation(pair, interval)
+    if generation is not None and generation != self._dir(pair, interval):
+      columns = self._columns(generation)
+      last = columns.timestamp[-1] if len(columns) else None
+      if last is None or bars.timestamp[0] > last:
+        self._append(generation, latest([self._tail(generation, last), bars]))
+        return
+
+    self._rewrite(pair, interval, latest([self.open(pair, interval), bars]))
+
+  def _append(self, generation, bars):
+    """ Appends all bars but the last to the columns, then makes the last one the tail """
+    rows = self._rows(generation)
+    for field in WRITE_ORDER:
+      dtype = DTYPES.get(field, DEFAULT_DTYPE)
+      with open(self._path(generation, field), 'ab') as f:
+        # drop whatever an interrupted append left after the last complete row
+        f.truncate(rows * dtype.itemsize)
+        f.write(np.ascontiguousarray(getattr(bars, field)[:-1], dtype=dtype).tobytes())
+    self._write_tail(generation, bars[-1:])
+
+  def _write_tail(self, generation, bars):
+    records = np.empty(len(bars), dtype=TAIL_DTYPE)
+    for field in series.FIELDS:
+      records[field] = getattr(bars, field)
+    tmp = self._path(generation, 'tail') + '.tmp'
+    records.tofile(tmp)
+    os.replace(tmp, self._path(generation, 'tail'))
+
+  def _rewrite(self, pair, interval, bars):
+    base = self._dir(pair, interval)
+    os.makedirs(base, exist_ok=True)
+    previous = [d for d in os.listdir(base) if re.match(r'g\d+$', d)]
+    name = 'g%d' % (max([int(d[1:]) for d in previous] + [0]) + 1)
+    generation = os.path.join(base, name)
+    os.mkdir(generation)
+    for field in WRITE_ORDER:
+      with open(self._path(generation, field), 'wb') as f:
+        f.write(np.ascontiguousarray(getattr(bars, field)[:-1], dtype=DTYPES.get(field, DEFAULT_DTYPE)).tobytes())
+    self._write_tail(generation, bars[-1:])
+
+    tmp = os.path.join(base, 'CURRENT.tmp')
+    with open(tmp, 'w') as f:
+      f.write(name)
+    os.replace(tmp, os.path.join(base, 'CURRENT'))
+
+    # readers keep the files they mapped, the directory entries can go
+    for old in previous:
+      shutil.rmtree(os.path.join(base, old), ignore_errors=True)
+    for field in series.FIELDS:
+      if os.path.exists(self._path(base, field)):
+        os.remove(self._path(base, field))
+
+  def listener(self, interval):
+    """ A TradeHistorySynchronizer listener writing the committed bars of the given interval """
+    return CacheListener(self, interval)
+
+def latest(parts):
+  """ Concatenates BarSeries into one sorted by timestamp, keeping the last occurrence of each timestamp """
+  bars = series.concat(parts)
+  bars = bars[np.argsort(bars.timestamp, kind='stable')]
+  return bars[np.r_[bars.timestamp[1:] != bars.timestamp[:-1], True]]
+
+class CacheListener(object):
+
+  def __init__(self, cache, interval):
+    self.cache = cache
+    self.interval = interval
+
+  def on_bars(self, pair, bars):
+    self.cache.fill(pair, self.interval, bars)
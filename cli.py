@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+""" Command line interface of kollybistes
+
+  cli.py init-db                             create the schema, once
+  cli.py dedupe                              fix ohlc tables from before the unique key
+  cli.py rebuild-rollups XETHZEUR            after syncing without rollups or a dedupe
+  cli.py migrate                             copy the ohlc tables into the compact schema
+  cli.py fill-cache XETHZEUR --cache DIR     seed a column cache, sync --cache keeps it current
+  cli.py sync XETHZEUR XXBTZEUR              fetch new bars
+  cli.py backfill XETHZEUR --since 2024-01-01
+  cli.py resample XETHZEUR --interval 240
+  cli.py backtest XETHZEUR --interval 60 --threshold 0.002
+  cli.py signal XETHZEUR --interval 240
+  cli.py signal XETHZEUR --interval 240 --checkpoint eth.json   only reads the bars since the last run
+
+The database URL is --db, else $KOLLYBISTES_DB. Modules are imported by the
+command that needs them, so e.g. a backtest on a --cache directory never
+loads SQLAlchemy, and --help doesn't even load numpy.
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import sys
+
+def _since(text):
+  return datetime.datetime.fromisoformat(text)
+
+def _engine(args):
+  import datastore
+  try:
+    return datastore.create_engine(args.db)
+  except ValueError as e:
+    sys.exit(str(e))
+
+@contextlib.contextmanager
+def _session(args):
+  import v1
+  with v1.session_scope(_engine(args)) as session:
+    yield session
+
+def _store(args):
+  if not args.compact:
+    return None
+  import compact
+  return compact.CompactStore(args.base_interval)
+
+def _syncer(args):
+  import v1
+  # only public endpoints are used, no need for keys.json
+  syncer = v1.TradeHistorySynchronizer(args.pairs, args.base_interval, api_key='', api_secret='',
+                                       workers=args.workers, store=_store(args),
+                                       batch=getattr(args, 'batch', False))
+  if args.cache:
+    import cache
+    syncer.listeners.append(cache.ColumnCache(args.cache).listener(args.base_interval))
+  return syncer
+
+def _bars(args):
+  """ The resampled bars of args.pair, oldest first, from the column cache or the database """
+  since = args.since or datetime.datetime.now() - datetime.timedelta(days=30)
+  if args.cache:
+    import cache
+    return cache.ColumnCache(args.cache).history(args.pair, args.interval, int(since.timestamp()))
+
+  import v1
+  with _session(args) as session:
+    return v1.TradeHistory(session, args.pair, args.interval, since, store=_store(args),
+                           base_interval=args.base_interval).bars()
+
+def _model(args):
+  import ann
+  return ann.load(args.model)
+
+def init_db(args):
+  import datastore
+  datastore.init(_engine(args))
+
+def dedupe(args):
+  import ohlc
+
+  engine = _engine(args)
+  with _session(args) as session:
+    deleted = ohlc.dedupe(session)
+  added = ohlc.add_unique_key(engine)
+  print("%d duplicate bars deleted, unique key %s" % (deleted, 'added' if added else 'already there'))
+  if deleted:
+    print("rebuild the rollups of the affected pairs")
+
+def rebuild_rollups(args):
+  import rollup
+
+  store = _store(args)
+  with _session(args) as session:
+    for pair in args.pairs:
+      if store is None:
+        rollup.rebuild(session, pair, rollup.usable(rollup.ROLLUP_INTERVALS, args.base_interval), args.since)
+      else:
+        since = None if args.since is None else int(args.since.timestamp())
+        store.update_rollups(session, pair, store.load(session, pair, store.base_interval, since).timestamp)
+      session.commit()
+      print("%s: rollups rebuilt" % pair)
+
+def fill_cache(args):
+  import cache
+  import v1
+
+  interval = args.interval or args.base_interval
+  since = args.since or datetime.datetime(1970, 1, 2)
+  column_cache = cache.ColumnCache(args.cache)
+  with _session(args) as session:
+    for pair in args.pairs:
+      bars = v1.TradeHistory(session, pair, interval, since, store=_store(args),
+                             base_interval=args.base_interval).bars()
+      column_cache.fill(pair, interval, bars)
+      print("%s: %d bars of %d minutes cached" % (pair, len(bars), interval))
+
+def migrate(args):
+  import compact
+
+  with _session(args) as session:
+    compact.migrate(session, compact.CompactStore(args.base_interval), args.batch_size)
+
+def sync(args):
+  syncer = _syncer(args)
+  try:
+    with _session(args) as session:
+      syncer.sync(session)
+  finally:
+    syncer.api.conn.close()
+
+def backfill(args):
+  import backfill
+
+  syncer = _syncer(args)
+  try:
+    with _session(args) as session:
+      for pair in args.pairs:
+        stored = backfill.Backfiller(syncer).backfill(session, pair, args.since)
+        print("%s: %d bars backfilled" % (pair, stored))
+  finally:
+    syncer.api.conn.close()
+
+def resample(args):
+  bars = _bars(args)
+  for bar in bars:
+    print("%s %f %f %f %f %f %f %d" % (bar.timestamp.strftime("%c"), bar.open, bar.high, bar.low,
+                                       bar.close, bar.vwap, bar.volume, bar.count))
+
+def backtest(args):
+  import backtest
+
+  bars = _bars(args)
+  result, trades = backtest.backtest(bars, _model(args), args.threshold, args.fee, args.short)
+  if args.trades:
+    for trade in trades:
+      print("%s %+.0f %f" % (datetime.datetime.fromtimestamp(trade.timestamp).strftime("%c"),
+                             trade.position, trade.price))
+  print("%s %d: return %.4f, max drawdown %.4f, %d trades, exposure %.2f" %
+        (args.pair, args.interval, result.total_return, result.max_drawdown, result.trades, result.exposure))
+
+def signal(args):
+  import ann
+  import backtest
+
+  if args.checkpoint:
+    return stream_signal(args)
+  bars = _bars(args)
+  if len(bars) < 2:
+    sys.exit("%s: not enough bars" % args.pair)
+  model = _model(args)
+  threshold = args.threshold if args.threshold is not None else model.threshold
+  predictions = backtest.predict(bars, model)
+  buying = ann.positions(predictions, threshold)[-1]
+  print("%s %s %+f %s" % (args.pair, bars[-1].timestamp.strftime("%c"), predictions[-1],
+                          'buy' if buying else 'sell'))
+
+def stream_signal(args):
+  import v1
+
+  if args.cache:
+    sys.exit("--checkpoint reads the database, not a --cache")
+  since = args.since or datetime.datetime.now() - datetime.timedelta(days=30)
+  strategy = v1.StreamingANNStrategy(args.pair, args.interval, _model(args), args.threshold, checkpoint=args.checkpoint)
+  with _session(args) as session:
+    strategy.catch_up(session, since, _store(args))
+  if strategy.prediction is None:
+    sys.exit("%s: not enough bars" % args.pair)
+  print(strategy.report())
+
+def parser():
+  # the model path, without importing v1 for v1.DEFAULT_MODEL
+  import os
+  default_model = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ann_strategy.pine')
+
+  main_parser = argparse.ArgumentParser(prog='kollybistes', description=__doc__.split('\n\n')[0])
+  main_parser.add_argument('--db', help="database URL, required unless $KOLLYBISTES_DB is set")
+  commands = main_parser.add_subparsers(dest='command', required=True)
+
+  def command(name, func, help):
+    sub = commands.add_parser(name, help=help)
+    sub.set_defaults(func=func)
+    return sub
+
+  def storage(sub):
+    sub.add_argument('--compact', action='store_true', help="use the compact schema")
+    sub.add_argument('--base-interval', type=int, default=5, help="interval of the stored bars in minutes")
+
+  def history(sub):
+    sub.add_argument('pair')
+    sub.add_argument('--interval', type=int, default=240, help="minutes")
+    sub.add_argument('--since', type=_since, help="ISO date, defaults to 30 days ago")
+    sub.add_argument('--cache', help="read the bars from this column cache instead of the database")
+    storage(sub)
+
+  def strategy(sub):
+    history(sub)
+    sub.add_argument('--model', default=default_model, help="Pine script or .npz")
+    sub.add_argument('--threshold', type=float, help="defaults to the model's")
+
+  command('init-db', init_db, "create the tables")
+  command('dedupe', dedupe, "delete duplicate ohlc bars and add the unique key")
+
+  for name, func, help in (('sync', sync, "fetch the latest bars"),
+                           ('backfill', backfill, "fill gaps from the Trades endpoint")):
+    sub = command(name, func, help)
+    sub.add_argument('pairs', nargs='+')
+    sub.add_argument('--workers', type=int, default=4)
+    storage(sub)
+    sub.add_argument('--cache', help="also append the stored bars to this column cache")
+    if name == 'sync':
+      sub.add_argument('--batch', action='store_true', help="write all pairs in one transaction")
+    if name == 'backfill':
+      sub.add_argument('--since', type=_since, help="ISO date, also fill from here to the first bar")
+
+  sub = command('rebuild-rollups', rebuild_rollups, "rebuild the rollups from the stored base bars")
+  sub.add_argument('pairs', nargs='+')
+  sub.add_argument('--since', type=_since, help="ISO date, defaults to all bars")
+  storage(sub)
+
+  sub = command('fill-cache', fill_cache, "copy stored bars into a column cache")
+  sub.add_argument('pairs', nargs='+')
+  sub.add_argument('--cache', required=True)
+  sub.add_argument('--interval', type=int, help="minutes, defaults to the base interval")
+  sub.add_argument('--since', type=_since, help="ISO date, defaults to all bars")
+  storage(sub)
+
+  sub = command('migrate', migrate, "copy the ohlc and ohlc_rollup rows into the compact schema")
+  sub.add_argument('--base-interval', type=int, default=5, help="interval of the ohlc bars in minutes")
+  sub.add_argument('--batch-size', type=int, default=50000, help="rows per commit")
+
+  history(command('resample', resample, "print resampled bars"))
+
+  sub = command('backtest', backtest, "backtest the strategy")
+  strategy(sub)
+  sub.add_argument('--fee', type=float, default=0.0026, help="per trade")
+  sub.add_argument('--short', action='store_true', help="go short instead of flat on sell signals")
+  sub.add_argument('--trades', action='store_true', help="print every trade")
+
+  sub = command('signal', signal, "print the current signal")
+  strategy(sub)
+  sub.add_argument('--checkpoint', help="keep the strategy state in this file and only evaluate the new bars, up to the last closed one")
+  return main_parser
+
+def main(argv=None):
+  args = parser().parse_args(argv)
+
+  import metrics
+  with metrics.configure_from_env():
+    args.func(args)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,211 @@
+""" Opt-in compact storage schema for OHLC bars
+
+Pairs live in a dimension table with a small integer key, bars are keyed by
+(pair_id, interval, ts) -- the clustered primary key on InnoDB -- with ts in
+integer epoch seconds and prices as doubles, so range scans and sync lookups
+are index seeks and rows load as floats without Decimal conversion. Base bars
+and rollups share the table, told apart by their interval.
+
+On SQLite the table is WITHOUT ROWID, so it is clustered the same way, and
+upserts are a single INSERT .. ON CONFLICT DO UPDATE executemany. This is
+the layout to use there, e.g. `cli.py --db sqlite:///kollybistes.db sync
+--compact --batch`.
+
+Use a CompactStore with TradeHistorySynchronizer and TradeHistory, and
+migrate() (`cli.py migrate`) to copy the rows of the ohlc and ohlc_rollup
+tables over.
+
+"""
+
+import datastore
+import rollup
+import series
+
+from ohlc import OHLC, OHLCRollup
+
+from sqlalchemy import BigInteger, Column, Float, ForeignKey, Integer, SmallInteger, String
+from sqlalchemy import and_, bindparam, select
+
+import numpy as np
+
+class Pair(datastore.Base):
+  __tablename__ = 'pair'
+  id = Column(SmallInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+  name = Column(String(250), nullable=False, unique=True)
+
+class CompactOHLC(datastore.Base):
+  __tablename__ = 'ohlc_compact'
+  # on SQLite the rows are stored in the primary key b-tree itself, clustered like InnoDB
+  __table_args__ = {'sqlite_with_rowid': False}
+  pair_id = Column(SmallInteger, ForeignKey('pair.id'), primary_key=True, autoincrement=False)
+  interval = Column(SmallInteger, primary_key=True, autoincrement=False)
+  # 64 bit, a signed INT runs out in 2038
+  ts = Column(BigInteger, primary_key=True, autoincrement=False)
+  open = Column(Float(precision=53))
+  high = Column(Float(precision=53))
+  low = Column(Float(precision=53))
+  close = Column(Float(precision=53))
+  vwap = Column(Float(precision=53))
+  volume = Column(Float(precision=53))
+  count = Column(Integer)
+
+TABLE = CompactOHLC.__table__
+VALUES = ('open', 'high', 'low', 'close', 'vwap', 'volume', 'count')
+COLUMNS = [TABLE.c.ts] + [TABLE.c[name] for name in VALUES]
+
+SQLITE_UPSERT = 'INSERT INTO %s (pair_id, interval, ts, %s) VALUES (%s) ON CONFLICT (pair_id, interval, ts) DO UPDATE SET %s' % (
+  TABLE.name, ', '.join(VALUES), ', '.join('?' * (3 + len(VALUES))),
+  ', '.join('%s = excluded.%s' % (name, name) for name in VALUES))
+
+class CompactStore(object):
+  """ Reads and writes bars of the compact schema
+
+  base_interval is the interval of the synchronized bars, rollups the coarser
+  intervals kept up to date next to them.
+
+  """
+
+  def __init__(self, base_interval=5, rollups=rollup.ROLLUP_INTERVALS):
+    self.base_interval = base_interval
+    self.rollups = rollup.usable(rollups, base_interval)
+    self.pair_ids = {}
+
+  def pair_id(self, session, name):
+    pair_id = self.pair_ids.get(name)
+    if pair_id is None:
+      pair = session.query(Pair).filter(Pair.name == name).first()
+      if pair is None:
+        pair = Pair(name = name)
+        session.add(pair)
+        session.flush()
+      pair_id = self.pair_ids[name] = pair.id
+    return pair_id
+
+  def load_ranges(self, session, pair, interval, ranges):
+    """ Bars of pair and interval in any of the [start, end) epoch ranges (end None for open ended) """
+    parts = []
+    for i in range(0, len(ranges), 100):
+      query = select(*COLUMNS).where( and_( TABLE.c.pair_id == self.pair_id(session, pair),
+                                            TABLE.c.interval == interval,
+                                            rollup.within(TABLE.c.ts, ranges[i:i + 100]) ))
+      rows = session.execute(query.order_by(TABLE.c.ts)).all()
+      if rows:
+        parts.append(series.BarSeries(*zip(*rows)))
+    return series.concat(parts) if parts else series.BarSeries.empty()
+
+  def load(self, session, pair, interval, since=None, until=None):
+    """ Bars of pair and interval with since <= ts < until (epoch seconds) as a BarSeries """
+    # a Core select, ORM row processing would double the cost of large loads
+    query = select(*COLUMNS).where( and_( TABLE.c.pair_id == self.pair_id(session, pair),
+                                          TABLE.c.interval == interval ))
+    if since is not None:
+      query = query.where(TABLE.c.ts >= since)
+    if until is not None:
+      query = query.where(TABLE.c.ts < until)
+    rows = session.execute(query.order_by(TABLE.c.ts)).all()
+    if not rows:
+      return series.BarSeries.empty()
+    return series.BarSeries(*zip(*rows))
+
+  def history(self, session, pair, interval, since):
+    """ Bars of pair since the given epoch, read from the closest rollup and resampled to interval """
+    step = rollup.closest(interval, self.rollups)
+    if step is None:
+      bars = self.load(session, pair, self.base_interval, since)
+    else:
+      # base bars wherever no rollup row covers them, as in TradeHistory
+      aligned = -(-since // (step * 60)) * step * 60
+      body = self.load(session, pair, step, aligned)
+      edge = self.load_ranges(session, pair, self.base_interval, rollup.uncovered(body.timestamp, step * 60, since))
+      bars = series.concat([edge, body])
+    return series.resample(bars, interval)
+
+  def upsert(self, session, pair, interval, bars):
+    """ Writes bars, returns (new, existing, updated, changed) with changed the written BarSeries """
+    if len(bars) == 0:
+      return 0, 0, 0, bars
+
+    pair_id = self.pair_id(session, pair)
+    stored = self.load(session, pair, interval, int(bars.timestamp.min()), int(bars.timestamp.max()) + 1)
+
+    # match the bars to the stored ones by timestamp and compare them column by column
+    if len(stored):
+      index = np.minimum(np.searchsorted(stored.timestamp, bars.timestamp), len(stored) - 1)
+      found = stored.timestamp[index] == bars.timestamp
+      differs = np.zeros(len(bars), dtype=bool)
+      for name in VALUES:
+        differs |= getattr(stored, name)[index] != getattr(bars, name)
+      updated = found & differs
+    else:
+      found = updated = np.zeros(len(bars), dtype=bool)
+    new = ~found
+    changed = new | updated
+
+    if session.get_bind().dialect.name == 'sqlite':
+      self._upsert_sqlite(session, pair_id, interval, bars[changed])
+    else:
+      self._insert(session, pair_id, interval, bars[new])
+      self._update(session, pair_id, interval, bars[updated])
+
+    return int(new.sum()), int(found.sum()), int(updated.sum()), bars[changed]
+
+  def _params(self, bars):
+    return list(zip(bars.timestamp.tolist(), *(getattr(bars, name).tolist() for name in VALUES)))
+
+  def _insert(self, session, pair_id, interval, bars):
+    if len(bars):
+      session.execute(TABLE.insert(), [dict(zip(('ts',) + VALUES, row), pair_id = pair_id, interval = interval)
+                                       for row in self._params(bars)])
+
+  def _update(self, session, pair_id, interval, bars):
+    if len(bars):
+      session.execute(TABLE.update().where( and_( TABLE.c.pair_id == bindparam('b_pair_id'),
+                                                  TABLE.c.interval == bindparam('b_interval'),
+                                                  TABLE.c.ts == bindparam('b_ts') )),
+                      [dict(zip(('b_ts',) + VALUES, row), b_pair_id = pair_id, b_interval = interval)
+                       for row in self._params(bars)])
+
+  def _upsert_sqlite(self, session, pair_id, interval, bars):
+    """ Inserts and updates in one executemany of INSERT .. ON CONFLICT DO UPDATE, straight on the driver """
+    if len(bars):
+      session.connection().exec_driver_sql(SQLITE_UPSERT, [(pair_id, interval) + row for row in self._params(bars)])
+
+  def update_rollups(self, session, pair, timestamps):
+    """ Re-aggregates the rollup buckets containing any of the given base bar epochs """
+    for interval in self.rollups:
+      step = interval * 60
+      touched = np.unique(np.asarray(timestamps, dtype=np.int64) // step * step)
+      if len(touched) == 0:
+        continue
+      bars = series.resample(self.load(session, pair, self.base_interval, int(touched[0]), int(touched[-1]) + step), interval)
+      self.upsert(session, pair, interval, bars[np.isin(bars.timestamp, touched)])
+
+def migrate(session, store, batch_size=50000):
+  """ Copies the ohlc (as store.base_interval bars) and ohlc_rollup rows into the compact schema
+
+  Walks the source tables by primary key in batches and commits after each,
+  so it can be interrupted and run again; rows already copied are skipped.
+
+  """
+  for model in (OHLC, OHLCRollup):
+    columns = [model.id, model.pair, model.timestamp, model.open, model.high, model.low,
+               model.close, model.vwap, model.volume, model.count]
+    if model is OHLCRollup:
+      columns.append(model.interval)
+
+    last_id = 0
+    while True:
+      rows = session.query(*columns).filter(model.id > last_id).\
+             order_by(model.id).limit(batch_size).all()
+      if not rows:
+        break
+      last_id = rows[-1][0]
+
+      groups = {}
+      for row in rows:
+        interval = row[10] if model is OHLCRollup else store.base_interval
+        groups.setdefault((row[1], interval), []).append(row[2:10])
+
+      for (pair, interval), group in groups.items():
+        store.upsert(session, pair, interval, series.BarSeries.from_rows(group))
+      session.commit()
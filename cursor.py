@@ -0,0 +1,15 @@
+import datastore
+
+from sqlalchemy import Column, Integer, BigInteger, String
+
+class SyncCursor(datastore.Base):
+  """ Per pair and interval watermark of the Kraken OHLC feed
+
+  'last' is the cursor Kraken returned with the previous response; it is
+  sent back as 'since' so that only the bars after it are transferred.
+
+  """
+  __tablename__ = 'sync_cursor'
+  pair = Column(String(250), primary_key=True)
+  interval = Column(Integer, primary_key=True, autoincrement=False)
+  last = Column(BigInteger)
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+""" Long-running synchronizer with bar-close aligned polling
+
+Keeps the process, the database engine and the pooled Kraken connections
+warm, and polls each pair just after its bar closes (plus jitter), instead
+of a cron job cold starting and refetching every minute. Pairs that fail --
+EAPI:Rate limit, HTTP or network errors -- are retried with exponential
+backoff. Per pair health and lag are served as JSON on --health-port.
+
+With --signal the strategy is evaluated as the bars come in, by a
+v1.StreamingANNStrategy per pair, and each signal is printed when a bucket
+closes. --checkpoint-dir keeps their state across restarts.
+
+"""
+
+import argparse
+import datetime
+import heapq
+import json
+import os
+import random
+import signal
+import threading
+import time
+
+import http.server
+
+import datastore
+import metrics
+import v1
+
+class PairState(object):
+
+  def __init__(self, pair):
+    self.pair = pair
+    self.due = 0.0
+    self.failures = 0
+    self.last_error = None
+    self.last_success = None
+    self.last_bar = None
+
+  def health(self, now, step):
+    return {
+      'due_in': round(self.due - now, 3),
+      'failures': self.failures,
+      'last_error': self.last_error,
+      # seconds since the last successful poll, and since the close of the last committed bar
+      'poll_lag': None if self.last_success is None else round(now - self.last_success, 3),
+      'data_lag': None if self.last_bar is None else round(now - (self.last_bar + step), 3),
+    }
+
+class SyncDaemon(object):
+
+  def __init__(self, syncer, engine, delay=2.0, jitter=3.0, backoff=5.0, max_backoff=600.0):
+    """ Polls delay + [0, jitter) seconds after each bar close, backs off from backoff up to max_backoff seconds """
+    self.syncer = syncer
+    self.engine = engine
+    self.step = syncer.interval * 60
+    self.delay = delay
+    self.jitter = jitter
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.states = dict((pair, PairState(pair)) for pair in syncer.tickers)
+    self.queue = []
+    self.stopped = threading.Event()
+
+  def _next_close(self, now):
+    return (int(now) // self.step + 1) * self.step + self.delay + random.uniform(0, self.jitter)
+
+  def _schedule(self, state, due):
+    state.due = due
+    heapq.heappush(self.queue, (due, state.pair))
+
+  def run(self):
+    now = time.time()
+    for state in self.states.values():
+      # poll once right away to catch up, then on bar closes
+      self._schedule(state, now + random.uniform(0, self.jitter))
+
+    while not self.stopped.is_set():
+      due, _ = self.queue[0]
+      if self.stopped.wait(max(0.0, due - time.time())):
+        break
+
+      now = time.time()
+      pairs = []
+      while self.queue and self.queue[0][0] <= now:
+        pairs.append(heapq.heappop(self.queue)[1])
+      self.poll(pairs)
+
+  def poll(self, pairs):
+    with v1.session_scope(self.engine) as session:
+      try:
+        errors = self.syncer.try_sync(session, pairs)
+      except Exception as e:
+        # e.g. the database is gone, every pair failed
+        errors = dict((pair, e) for pair in pairs)
+      lasts = {}
+      for pair in pairs:
+        if pair not in errors:
+          lasts[pair] = self.syncer._get_cursor(pair, session).last
+
+    now = time.time()
+    for pair in pairs:
+      state = self.states[pair]
+      error = errors.get(pair)
+      if error is None:
+        state.failures = 0
+        state.last_error = None
+        state.last_success = now
+        state.last_bar = lasts[pair]
+        self._schedule(state, self._next_close(now))
+      else:
+        state.failures += 1
+        state.last_error = repr(error)
+        delay = min(self.max_backoff, self.backoff * 2 ** (state.failures - 1))
+        print("%s poll failed (%d in a row), retrying in %.1fs: %r" % (pair, state.failures, delay, error))
+        self._schedule(state, now + delay + random.uniform(0, self.jitter))
+
+    metrics.inc('daemon_polls_total', len(pairs) - len(errors), {'result': 'ok'})
+    metrics.inc('daemon_polls_total', len(errors), {'result': 'error'})
+    metrics.flush()
+
+  def stop(self):
+    self.stopped.set()
+
+  def health(self):
+    now = time.time()
+    pairs = dict((pair, state.health(now, self.step)) for pair, state in self.states.items())
+    return {
+      'healthy': all(state.failures == 0 for state in self.states.values()),
+      'interval': self.syncer.interval,
+      'pairs': pairs,
+    }
+
+  def serve_health(self, port, host='127.0.0.1'):
+    """ Serves health() as JSON on GET / from a background thread """
+    daemon = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        health = daemon.health()
+        body = json.dumps(health, indent=2).encode()
+        self.send_response(200 if health['healthy'] else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+def strategies(engine, args, store=None):
+  """ A StreamingANNStrategy per pair, caught up with the stored bars of the last 30 days or since its checkpoint """
+  since = datetime.datetime.now() - datetime.timedelta(days=30)
+  result = []
+  with v1.session_scope(engine) as session:
+    for pair in args.pairs:
+      checkpoint = None
+      if args.checkpoint_dir:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        checkpoint = os.path.join(args.checkpoint_dir, '%s-%d.json' % (pair, args.signal))
+      strategy = v1.StreamingANNStrategy(pair, args.signal, checkpoint=checkpoint)
+      strategy.catch_up(session, since, store)
+      print(strategy.report())
+      result.append(strategy)
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('pairs', nargs='+')
+  parser.add_argument('--db', help="database URL, required unless $KOLLYBISTES_DB is set")
+  parser.add_argument('--interval', type=int, default=5, help="base interval in minutes")
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--batch', action='store_true', help="write all pairs of a poll in one transaction")
+  parser.add_argument('--compact', action='store_true', help="write to the compact schema")
+  parser.add_argument('--health-port', type=int)
+  parser.add_argument('--cache', help="also append the synced bars to this column cache")
+  parser.add_argument('--signal', type=int, metavar='MINUTES', help="print the strategy signals at this interval")
+  parser.add_argument('--checkpoint-dir', help="keep the --signal state here across restarts")
+  args = parser.parse_args()
+
+  try:
+    engine = datastore.create_engine(args.db)
+  except ValueError as e:
+    parser.error(str(e))
+  store = None
+  if args.compact:
+    import compact
+    store = compact.CompactStore(args.interval)
+  # only the public OHLC endpoint is polled, no need for keys.json
+  syncer = v1.TradeHistorySynchronizer(args.pairs, args.interval, api_key='', api_secret='',
+                                       workers=args.workers, store=store, batch=args.batch)
+  if args.cache:
+    import cache
+    syncer.listeners.append(cache.ColumnCache(args.cache).listener(args.interval))
+  if args.signal:
+    syncer.listeners.extend(strategies(engine, args, store))
+  daemon = SyncDaemon(syncer, engine)
+  if args.health_port:
+    daemon.serve_health(args.health_port)
+
+  signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+  try:
+    with metrics.configure_from_env():
+      daemon.run()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    syncer.api.conn.close()
+
+if __name__ == '__main__':
+  main()
@@ -1,4 +1,69 @@
-from sqlalchemy import *
-from sqlalchemy.ext.declarative import declarative_base
+""" The declarative base of the models and the database configuration
+
+The database URL is taken from the caller (e.g. --db), else from the
+KOLLYBISTES_DB environment variable; there is no default, so credentials
+stay out of the code. Nothing connects or creates tables on import; create
+the schema once with init(), or `cli.py init-db`.
+
+SQLite databases are opened in WAL mode with the SQLITE_PRAGMAS, so range
+reads run concurrently with the single writer, and with explicit BEGINs so
+SAVEPOINTs (session.begin_nested()) work.
+
+"""
+
+import os
+
+from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
+
+# page_size only takes effect on a new database (or after VACUUM),
+# synchronous=NORMAL is durable in WAL mode except for the last commits on power loss
+SQLITE_PRAGMAS = (
+  ('page_size', 8192),
+  ('journal_mode', 'WAL'),
+  ('synchronous', 'NORMAL'),
+  ('mmap_size', 1 << 30),
+  ('cache_size', -65536),
+  ('temp_store', 'MEMORY'),
+  ('busy_timeout', 10000),
+)
+
+def database_url(url=None, environ=os.environ):
+  """ url, else $KOLLYBISTES_DB; raises ValueError if neither is set """
+  url = url or environ.get('KOLLYBISTES_DB')
+  if not url:
+    raise ValueError("no database URL, pass --db or set KOLLYBISTES_DB")
+  return url
+
+def create_engine(url=None, pragmas=SQLITE_PRAGMAS, **kwargs):
+  import sqlalchemy
+  engine = sqlalchemy.create_engine(database_url(url), **kwargs)
+  if engine.dialect.name == 'sqlite':
+    configure_sqlite(engine, pragmas)
+  return engine
+
+def configure_sqlite(engine, pragmas=SQLITE_PRAGMAS):
+  """ Sets the pragmas on every new connection of a SQLite engine and lets SQLAlchemy emit BEGIN """
+  from sqlalchemy import event
+
+  @event.listens_for(engine, 'connect')
+  def connect(dbapi_connection, connection_record):
+    # the sqlite3 module would otherwise begin transactions itself, late, and break SAVEPOINT
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+      cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+  @event.listens_for(engine, 'begin')
+  def begin(connection):
+    connection.exec_driver_sql('BEGIN')
+
+def init(engine):
+  """ Creates the tables of all models that don't exist yet """
+  # registers the models with Base
+  import compact
+  import cursor
+  import ohlc
+  Base.metadata.create_all(engine)
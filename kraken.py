@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 
+import concurrent.futures
+import itertools
 import json
 import time
 
@@ -12,11 +14,76 @@ import urllib.request
 import urllib.parse
 import urllib.error
 
+import queue
+import threading
+
+import metrics
+
+# (burst, calls per second) -- Kraken's public endpoints tolerate roughly
+# one call per second, the private call counter of a starter tier account
+# holds 15 and decays by 0.33 per second
+PUBLIC_BUDGET = (10, 1.0)
+PRIVATE_BUDGET = (15, 0.33)
+
+# private calls that increase the call counter by 2 instead of 1
+PRIVATE_COSTS = {
+  'Ledgers': 2,
+  'QueryLedgers': 2,
+  'TradesHistory': 2,
+  'QueryTrades': 2,
+}
+
+# paginated private calls and the result key holding their entries, Kraken
+# returns PAGE_SIZE entries per call from the 'ofs' offset
+PAGINATED = {
+  'TradesHistory': 'trades',
+  'Ledgers': 'ledger',
+}
+PAGE_SIZE = 50
+
+class TokenBucket(object):
+  """ Thread-safe token bucket, acquire() blocks until the call fits into the budget """
+
+  def __init__(self, capacity, rate):
+    self.capacity = float(capacity)
+    self.rate = float(rate)
+    self.tokens = float(capacity)
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self, cost=1):
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+          self.tokens -= cost
+          return
+        wait = (cost - self.tokens) / self.rate
+      time.sleep(wait)
+
+class NonceCounter(object):
+  """ Thread-safe, strictly increasing nonces, in milliseconds since the epoch while calls are sparser than that """
+
+  def __init__(self):
+    self.last = 0
+    self.lock = threading.Lock()
+
+  def next(self):
+    with self.lock:
+      self.last = max(self.last + 1, int(1000*time.time()))
+      return self.last
+
 class Connection(object):
 
-  def __init__(self, uri='api.kraken.com', timeout=30):
+  def __init__(self, uri='api.kraken.com', timeout=30, secure=True):
     self.headers = {}
-    self.conn = http.client.HTTPSConnection(uri, timeout=timeout)
+    if secure:
+      self.conn = http.client.HTTPSConnection(uri, timeout=timeout)
+    else:
+      # plain HTTP, e.g. for a local replay.ReplayServer
+      self.conn = http.client.HTTPConnection(uri, timeout=timeout)
     return
 
   def close(self):
@@ -33,24 +100,105 @@ class Connection(object):
     data = urllib.parse.urlencode(req)
     headers.update(self.headers)
 
-    self.conn.request('POST', url, data, headers)
-    response = self.conn.getresponse()
+    with metrics.timer('kraken_request_seconds'):
+      try:
+        self.conn.request('POST', url, data, headers)
+        response = self.conn.getresponse()
+      except (http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+        # the server dropped the keep-alive socket, reconnect once
+        metrics.inc('kraken_reconnects_total')
+        self.conn.close()
+        self.conn.request('POST', url, data, headers)
+        response = self.conn.getresponse()
+
+      # always drain the body, the connection can't be reused otherwise
+      body = response.read()
+
+    metrics.inc('kraken_requests_total', labels={'status': response.status})
+    metrics.inc('kraken_response_bytes_total', len(body))
+    metrics.observe('kraken_response_bytes', len(body), buckets=metrics.SIZE_BUCKETS)
 
     if response.status not in (200,201,202):
       raise http.client.HTTPException(response.status)
 
-    return response.read().decode()
+    return body.decode()
+
+class ConnectionPool(object):
+  """ Thread-safe pool of keep-alive connections with the Connection interface """
+
+  def __init__(self, uri='api.kraken.com', size=4, timeout=30, secure=True):
+    self.uri = uri
+    self.timeout = timeout
+    self.secure = secure
+    self.idle = queue.LifoQueue()
+    self.slots = threading.BoundedSemaphore(size)
+    return
+
+  def close(self):
+    while True:
+      try:
+        self.idle.get_nowait().close()
+      except queue.Empty:
+        return
+
+  def _request(self, url, req=None, headers=None):
+    with self.slots:
+      try:
+        conn = self.idle.get_nowait()
+      except queue.Empty:
+        conn = Connection(self.uri, self.timeout, self.secure)
+
+      try:
+        ret = conn._request(url, req, headers)
+      except:
+        conn.close()
+        raise
+
+      self.idle.put(conn)
+      return ret
 
 class API(object):
+  """ Kraken REST client
+
+  The decoded secret is kept as a keyed HMAC, copied for each signature.
+  Nonces come from a NonceCounter, share one between API objects using the
+  same key. Concurrent private calls can still arrive out of nonce order,
+  the key needs a nonce window for them (and conn a ConnectionPool).
 
-  def __init__(self, key='', secret='', conn=None):
+  """
+
+  def __init__(self, key='', secret='', conn=None, public_limiter=None, private_limiter=None, nonce=None):
     self.key = key
     self.secret = secret
     self.uri = 'https://api.kraken.com'
     self.apiversion = '0'
     self.conn = conn
+    if public_limiter is None:
+      public_limiter = TokenBucket(*PUBLIC_BUDGET)
+    if private_limiter is None:
+      private_limiter = TokenBucket(*PRIVATE_BUDGET)
+    if nonce is None:
+      nonce = NonceCounter()
+    self.public_limiter = public_limiter
+    self.private_limiter = private_limiter
+    self.nonce = nonce
     return
 
+  @property
+  def secret(self):
+    return self._secret
+
+  @secret.setter
+  def secret(self, secret):
+    self._secret = secret
+    # decoded on the first signature
+    self._hmac = None
+
+  def _signer(self):
+    if self._hmac is None:
+      self._hmac = hmac.new(base64.b64decode(self._secret), digestmod=hashlib.sha512)
+    return self._hmac.copy()
+
   def _query(self, urlpath, req, conn=None, headers=None):
     url = self.uri + urlpath
 
@@ -63,7 +211,8 @@ class API(object):
       headers = {}
 
     ret = conn._request(url, req, headers)
-    return json.loads(ret)
+    with metrics.timer('kraken_json_decode_seconds'):
+      return json.loads(ret)
 
   def loadkeys(self, jsonfile):
     with open(jsonfile) as f:
@@ -78,6 +227,7 @@ class API(object):
     if req is None:
       req = {}
 
+    self.public_limiter.acquire()
     return self._query(urlpath, req, conn)
 
   def query_private(self, method, req=None, conn=None):
@@ -85,14 +235,16 @@ class API(object):
       req = {}
 
     urlpath = '/' + self.apiversion + '/private/' + method
-    
-    req['nonce'] = int(1000*time.time())
+
+    self.private_limiter.acquire(PRIVATE_COSTS.get(method, 1))
+    req['nonce'] = self.nonce.next()
     postdata = urllib.parse.urlencode(req)
 
     encoded = (str(req['nonce']) + postdata).encode()
     message = urlpath.encode() + hashlib.sha256(encoded).digest()
 
-    signature = hmac.new(base64.b64decode(self.secret), message, hashlib.sha512)
+    signature = self._signer()
+    signature.update(message)
     sigdigest = base64.b64encode(signature.digest())
 
     headers = {
@@ -102,6 +254,50 @@ class API(object):
 
     return self._query(urlpath, req, conn, headers)
 
+  def paginate(self, method, req=None, workers=4):
+    """ Yields (id, entry) of every page of TradesHistory or Ledgers
 
+    The first page tells the total count. The later offsets are fetched
+    concurrently, at most workers at a time and within the private rate
+    budget, and their entries are yielded as the pages arrive, so not in
+    order. Entries shifted onto a later page by new trades during the walk
+    are yielded once.
 
+    """
+    key = PAGINATED[method]
+    if req is None:
+      req = {}
 
+    def page(ofs):
+      result = self.query_private(method, dict(req, ofs=ofs))
+      if result.get('error'):
+        raise Exception(result['error'])
+      return result['result']
+
+    first = req.get('ofs', 0)
+    result = page(first)
+    offsets = iter(range(first + PAGE_SIZE, result['count'], PAGE_SIZE))
+    seen = set()
+
+    def entries(result):
+      for id, entry in result[key].items():
+        if id not in seen:
+          seen.add(id)
+          yield id, entry
+
+    yield from entries(result)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+      pending = set(executor.submit(page, ofs) for ofs in itertools.islice(offsets, workers))
+      try:
+        while pending:
+          done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+          for future in done:
+            result = future.result()
+            for ofs in itertools.islice(offsets, 1):
+              pending.add(executor.submit(page, ofs))
+            yield from entries(result)
+      finally:
+        # the caller stopped early or a page failed
+        for future in pending:
+          future.cancel()
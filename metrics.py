@@ -0,0 +1,235 @@
+""" Lightweight counters, timers and histograms for the hot paths
+
+Disabled by default, in which case inc(), observe() and timer() return
+immediately (timer() hands out a shared no-op context manager). Once
+enabled, values accumulate in-process and can be written as a Prometheus
+text file and/or sent to a StatsD daemon over UDP:
+
+  metrics.enable(textfile='/var/lib/node_exporter/kollybistes.prom', statsd='localhost:8125')
+
+configure_from_env() does the same from KOLLYBISTES_METRICS (text file),
+KOLLYBISTES_STATSD (host:port) and KOLLYBISTES_PROFILE (profile() output).
+
+"""
+
+import atexit
+import bisect
+import contextlib
+import os
+import socket
+import threading
+import time
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_enabled = False
+
+class Histogram(object):
+
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+class StatsdSink(object):
+
+  def __init__(self, address, prefix='kollybistes.'):
+    host, port = address.rsplit(':', 1)
+    self.address = (host, int(port))
+    self.prefix = prefix
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+  def _send(self, line):
+    try:
+      self.sock.sendto(line.encode(), self.address)
+    except OSError:
+      pass
+
+  def counter(self, name, value):
+    self._send('%s%s:%g|c' % (self.prefix, name, value))
+
+  def timing(self, name, seconds):
+    self._send('%s%s:%g|ms' % (self.prefix, name, seconds * 1000))
+
+  def histogram(self, name, value):
+    self._send('%s%s:%g|h' % (self.prefix, name, value))
+
+class Registry(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counters = {}
+    self.histograms = {}
+    self.statsd = None
+    self.textfile = None
+
+  def inc(self, name, value=1, labels=None):
+    key = (name, _labels(labels))
+    with self.lock:
+      self.counters[key] = self.counters.get(key, 0) + value
+    if self.statsd is not None:
+      self.statsd.counter(_flat(key), value)
+
+  def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS, timing=False):
+    key = (name, _labels(labels))
+    with self.lock:
+      histogram = self.histograms.get(key)
+      if histogram is None:
+        histogram = self.histograms[key] = Histogram(buckets)
+      histogram.observe(value)
+    if self.statsd is not None:
+      if timing:
+        self.statsd.timing(_flat(key), value)
+      else:
+        self.statsd.histogram(_flat(key), value)
+
+  def prometheus(self):
+    """ The current values in the Prometheus text exposition format """
+    lines = []
+    with self.lock:
+      for (name, labels), value in sorted(self.counters.items()):
+        lines.append('%s%s %g' % (name, _format(labels), value))
+      for (name, labels), histogram in sorted(self.histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+          cumulative += count
+          lines.append('%s_bucket%s %d' % (name, _format(labels + (('le', str(bound)),)), cumulative))
+        lines.append('%s_sum%s %g' % (name, _format(labels), histogram.sum))
+        lines.append('%s_count%s %d' % (name, _format(labels), histogram.count))
+    return '\n'.join(lines) + '\n'
+
+  def flush(self):
+    """ Rewrites the text file, if one is configured """
+    if self.textfile is None:
+      return
+    tmp = self.textfile + '.tmp'
+    with open(tmp, 'w') as f:
+      f.write(self.prometheus())
+    os.replace(tmp, self.textfile)
+
+  def reset(self):
+    with self.lock:
+      self.counters.clear()
+      self.histograms.clear()
+
+REGISTRY = Registry()
+
+def _labels(labels):
+  if not labels:
+    return ()
+  return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format(labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (k, v.replace('"', '\\"')) for k, v in labels)
+
+def _flat(key):
+  name, labels = key
+  return '.'.join([name] + [v for _, v in labels])
+
+class _Timer(object):
+
+  __slots__ = ('name', 'labels', 'start')
+
+  def __init__(self, name, labels):
+    self.name = name
+    self.labels = labels
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    REGISTRY.observe(self.name, time.perf_counter() - self.start, self.labels, timing=True)
+    return False
+
+class _NullTimer(object):
+
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_NULL_TIMER = _NullTimer()
+
+def enabled():
+  return _enabled
+
+def enable(textfile=None, statsd=None):
+  global _enabled
+  if textfile is not None:
+    REGISTRY.textfile = textfile
+    atexit.register(REGISTRY.flush)
+  if statsd is not None:
+    REGISTRY.statsd = StatsdSink(statsd)
+  _enabled = True
+
+def disable():
+  global _enabled
+  _enabled = False
+
+def inc(name, value=1, labels=None):
+  if _enabled:
+    REGISTRY.inc(name, value, labels)
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS):
+  if _enabled:
+    REGISTRY.observe(name, value, labels, buckets)
+
+def timer(name, labels=None):
+  """ Context manager observing the wall time of its block in seconds """
+  if not _enabled:
+    return _NULL_TIMER
+  return _Timer(name, labels)
+
+def flush():
+  if _enabled:
+    REGISTRY.flush()
+
+@contextlib.contextmanager
+def profile(path, memory=False):
+  """ Captures a cProfile of the block into path, and with memory=True the top tracemalloc allocations into path.mem.txt """
+  # imported here, they are a good part of the import time of this module
+  import cProfile
+  import tracemalloc
+
+  profiler = cProfile.Profile()
+  if memory:
+    tracemalloc.start()
+  profiler.enable()
+  try:
+    yield profiler
+  finally:
+    profiler.disable()
+    profiler.dump_stats(path)
+    if memory:
+      snapshot = tracemalloc.take_snapshot()
+      tracemalloc.stop()
+      with open(path + '.mem.txt', 'w') as f:
+        for stat in snapshot.statistics('lineno')[:50]:
+          f.write('%s\n' % stat)
+
+def configure_from_env(environ=os.environ):
+  """ Enables metrics from the KOLLYBISTES_* variables, returns a profile() context for KOLLYBISTES_PROFILE """
+  textfile = environ.get('KOLLYBISTES_METRICS')
+  statsd = environ.get('KOLLYBISTES_STATSD')
+  if textfile or statsd:
+    enable(textfile=textfile or None, statsd=statsd or None)
+
+  path = environ.get('KOLLYBISTES_PROFILE')
+  if path:
+    return profile(path, memory=environ.get('KOLLYBISTES_PROFILE_MEMORY') == '1')
+  return contextlib.nullcontext()
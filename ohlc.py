@@ -1,11 +1,11 @@
 import datastore
 
-from sqlalchemy import *
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, DateTime, Integer, Numeric, String, UniqueConstraint
+from sqlalchemy import and_, func, inspect, text
 
 class OHLC(datastore.Base):
   __tablename__ = 'ohlc'
+  __table_args__ = (UniqueConstraint('pair', 'timestamp', name='uq_ohlc_pair_timestamp'),)
   id = Column(Integer, primary_key=True)
   pair = Column(String(250), nullable=False)
   timestamp = Column(DateTime)
@@ -41,3 +41,53 @@ class OHLC(datastore.Base):
       #print("__eq__: timestamps dont match")
       return False
 
+
+class OHLCRollup(datastore.Base):
+  """ OHLC bars pre-aggregated to a coarser interval, maintained by the synchronizer """
+  __tablename__ = 'ohlc_rollup'
+  __table_args__ = (UniqueConstraint('pair', 'interval', 'timestamp', name='uq_ohlc_rollup_pair_interval_timestamp'),)
+  id = Column(Integer, primary_key=True)
+  pair = Column(String(250), nullable=False)
+  interval = Column(Integer, nullable=False)
+  timestamp = Column(DateTime)
+  open = Column(Numeric(precision=18, scale=6))
+  high = Column(Numeric(precision=18, scale=6))
+  low = Column(Numeric(precision=18, scale=6))
+  close = Column(Numeric(precision=18, scale=6))
+  vwap = Column(Numeric(precision=18, scale=6))
+  volume = Column(Numeric(precision=25, scale=12))
+  count = Column(Integer)
+
+
+def dedupe(session):
+  """ Deletes all but the newest row of each (pair, timestamp) stored more than once, returns the rows deleted
+
+  ohlc tables created before the unique key can hold the still open bar of
+  every poll several times. The caller commits; rebuild the rollups after.
+
+  """
+  newest = session.query(OHLC.pair, OHLC.timestamp, func.max(OHLC.id).label('id')).\
+           group_by(OHLC.pair, OHLC.timestamp).\
+           having(func.count(OHLC.id) > 1).subquery()
+  stale = [row[0] for row in session.query(OHLC.id).join(newest, and_( OHLC.pair == newest.c.pair,
+                                                                       OHLC.timestamp == newest.c.timestamp,
+                                                                       OHLC.id != newest.c.id ))]
+  deleted = 0
+  for i in range(0, len(stale), 500):
+    deleted += session.query(OHLC).filter(OHLC.id.in_(stale[i:i + 500])).delete(synchronize_session=False)
+  return deleted
+
+def add_unique_key(engine):
+  """ Adds the (pair, timestamp) unique key to an ohlc table created without it, returns False if it was there
+
+  create_all() doesn't alter existing tables. Run dedupe() first.
+
+  """
+  inspector = inspect(engine)
+  keys = [c['column_names'] for c in inspector.get_unique_constraints(OHLC.__tablename__)] + \
+         [i['column_names'] for i in inspector.get_indexes(OHLC.__tablename__) if i['unique']]
+  if ['pair', 'timestamp'] in keys:
+    return False
+  with engine.begin() as connection:
+    connection.execute(text('CREATE UNIQUE INDEX uq_ohlc_pair_timestamp ON ohlc (pair, timestamp)'))
+  return True
@@ -0,0 +1,163 @@
+""" Strategy evaluation over many pairs at once
+
+PortfolioHistory loads the bars of all pairs in one query and resamples them
+in one grouped pass into a Panel: pairs x time matrices aligned on the union
+of the pairs' bar timestamps, with NaN (count 0) where a pair has no bar.
+Panel.available tells missing bars from bars without trades.
+PortfolioStrategy runs the network over the whole panel as one batch and
+returns a pairs x time signal matrix. Unlike ANNStrategy, time runs oldest
+first, as in backtest and StreamingANNStrategy.
+
+"""
+
+import numpy as np
+
+import ann
+import metrics
+import series
+
+from ohlc import OHLC
+
+from sqlalchemy import and_
+
+class Panel(object):
+
+  def __init__(self, pairs, timestamp, columns, available):
+    self.pairs = list(pairs)
+    self.timestamp = timestamp
+    for field in series.FIELDS[1:]:
+      setattr(self, field, columns[field])
+    # whether each pair has a bar at each time, bars without trades (count 0) included
+    self.available = available
+
+  def bars(self, pair):
+    """ The bars of one pair as a BarSeries, without the missing ones """
+    i = self.pairs.index(pair)
+    mask = self.available[i]
+    return series.BarSeries(self.timestamp[mask], *(getattr(self, field)[i, mask] for field in series.FIELDS[1:]))
+
+def build_panel(pairs, pair_index, bars, interval):
+  """ Resamples bars of several pairs, sorted by (pair, timestamp), into a Panel
+
+  pair_index holds the position in pairs of each bar's pair.
+
+  """
+  step = int(interval * 60)
+  if len(bars) == 0:
+    empty = dict((field, np.empty((len(pairs), 0))) for field in series.FIELDS[1:])
+    return Panel(pairs, np.empty(0, dtype=np.int64), empty, np.empty((len(pairs), 0), dtype=bool))
+
+  bucket = bars.timestamp // step * step
+  starts = np.flatnonzero(np.r_[True, (bucket[1:] != bucket[:-1]) | (pair_index[1:] != pair_index[:-1])])
+  grouped = series.aggregate(bars, starts, bucket[starts])
+  rows = pair_index[starts]
+
+  timestamp = np.unique(grouped.timestamp)
+  cols = np.searchsorted(timestamp, grouped.timestamp)
+
+  columns = {}
+  for field in series.FIELDS[1:]:
+    matrix = np.full((len(pairs), len(timestamp)), 0 if field == 'count' else np.nan,
+                     dtype=np.int64 if field == 'count' else np.float64)
+    matrix[rows, cols] = getattr(grouped, field)
+    columns[field] = matrix
+  available = np.zeros((len(pairs), len(timestamp)), dtype=bool)
+  available[rows, cols] = True
+  return Panel(pairs, timestamp, columns, available)
+
+class PortfolioHistory(object):
+  """ Resampled bars of many pairs, loaded with one query
+
+  Reads the ohlc table, or with a compact.CompactStore its base interval bars.
+
+  """
+
+  def __init__(self, session, pairs, interval=5, since=None, store=None):
+    self.session = session
+    self.pairs = list(pairs)
+    self.interval = interval
+    self.since = since
+    self.store = store
+
+  def panel(self):
+    with metrics.timer('portfolio_load_seconds'):
+      pair_index, bars = self._load()
+    with metrics.timer('portfolio_resample_seconds'):
+      return build_panel(self.pairs, pair_index, bars, self.interval)
+
+  def _load(self):
+    if self.store is not None:
+      return self._load_compact()
+
+    query = self.session.query(OHLC.pair, OHLC.timestamp, OHLC.open, OHLC.high, OHLC.low,
+                               OHLC.close, OHLC.vwap, OHLC.volume, OHLC.count).\
+            filter(OHLC.pair.in_(self.pairs))
+    if self.since is not None:
+      query = query.filter(OHLC.timestamp >= self.since)
+    rows = query.order_by(OHLC.pair, OHLC.timestamp).all()
+
+    index = dict((pair, i) for i, pair in enumerate(self.pairs))
+    pair_index = np.array([index[row[0]] for row in rows], dtype=np.int64)
+    bars = series.BarSeries.from_rows([row[1:] for row in rows])
+    return self._sorted(pair_index, bars)
+
+  def _load_compact(self):
+    import compact
+
+    ids = dict((self.store.pair_id(self.session, pair), i) for i, pair in enumerate(self.pairs))
+    table = compact.TABLE
+    query = self.session.query(table.c.pair_id, *compact.COLUMNS).\
+            filter( and_( table.c.pair_id.in_(list(ids)),
+                          table.c.interval == self.store.base_interval ))
+    if self.since is not None:
+      query = query.filter(table.c.ts >= int(self.since.timestamp()))
+    rows = query.order_by(table.c.pair_id, table.c.ts).all()
+    if not rows:
+      return np.empty(0, dtype=np.int64), series.BarSeries.empty()
+
+    columns = list(zip(*rows))
+    pair_index = np.array([ids[pair_id] for pair_id in columns[0]], dtype=np.int64)
+    return self._sorted(pair_index, series.BarSeries(*columns[1:]))
+
+  def _sorted(self, pair_index, bars):
+    # ordered by the index in self.pairs, not the pair names or ids
+    order = np.lexsort((bars.timestamp, pair_index))
+    return pair_index[order], bars[order]
+
+class PortfolioStrategy(object):
+
+  def __init__(self, panel, model, threshold=None):
+    if threshold is None:
+      threshold = model.threshold
+    self.panel = panel
+    self.model = model
+    self.threshold = threshold
+
+  def predictions(self):
+    """ pairs x time network outputs, from each bar's VWAP change against the pair's previous bar
+
+    NaN where the pair has no bar or no earlier bar to compare with.
+
+    """
+    vwap = self.panel.vwap
+    available = self.panel.available
+    steps = np.arange(vwap.shape[1])
+
+    # index of the latest bar of the pair before each time, -1 if none
+    latest = np.where(available, steps, -1)
+    np.maximum.accumulate(latest, axis=1, out=latest)
+    previous = np.full_like(latest, -1)
+    previous[:, 1:] = latest[:, :-1]
+
+    valid = available & (previous >= 0)
+    rows, cols = np.nonzero(valid)
+    last = vwap[rows, previous[rows, cols]]
+
+    predictions = np.full(vwap.shape, np.nan)
+    predictions[rows, cols] = self.model.predict((vwap[rows, cols] - last) / last)
+    return predictions
+
+  def signals(self):
+    """ pairs x time buying states; a pair keeps its state over its missing bars """
+    with metrics.timer('portfolio_eval_seconds'):
+      return ann.positions(self.predictions(), self.threshold)
@@ -0,0 +1,155 @@
+""" Local stand-in for the Kraken REST API
+
+Serves recorded (e.g. resp1.json, resp2.json) or synthetic responses over
+plain HTTP, with configurable latency and injected rate limit and HTTP
+errors, so the synchronizer and the benchmarks run without api.kraken.com:
+
+  server = ReplayServer({'OHLC': [synthetic_ohlc('XETHZEUR', 720)]}, latency=0.05)
+  server.start()
+  api = kraken.API(conn=server.connection())
+
+"""
+
+import ast
+import json
+import threading
+import time
+import urllib.parse
+
+import http.server
+
+import numpy as np
+
+import kraken
+
+RATE_LIMIT = {'error': ['EAPI:Rate limit exceeded'], 'result': {}}
+
+def load_recorded(path):
+  """ Reads a captured response, either JSON or the repr() of the decoded dict """
+  with open(path) as f:
+    text = f.read()
+  try:
+    return json.loads(text)
+  except ValueError:
+    return ast.literal_eval(text)
+
+def synthetic_ohlc(pair, bars, interval=15, start=1500000000, seed=0):
+  """ An OHLC response of a random walk, in Kraken's format """
+  rng = np.random.default_rng(seed)
+  step = interval * 60
+  start = start // step * step
+  close = 250 * np.exp(np.cumsum(rng.normal(0, 0.003, bars)))
+  open = np.r_[close[0], close[:-1]]
+  spread = np.abs(rng.normal(0, 0.002, bars)) * close
+  high = np.maximum(open, close) + spread
+  low = np.minimum(open, close) - spread
+  vwap = (open + high + low + close) / 4
+  volume = rng.exponential(500, bars)
+  count = rng.integers(1, 500, bars)
+
+  rows = [[start + i * step, '%.5f' % open[i], '%.5f' % high[i], '%.5f' % low[i], '%.5f' % close[i],
+           '%.5f' % vwap[i], '%.8f' % volume[i], int(count[i])] for i in range(bars)]
+  last = rows[-2][0] if bars > 1 else start
+  return {'error': [], 'result': {pair: rows, 'last': last}}
+
+def _since(response, since):
+  """ Narrows an OHLC response to the bars after since, like Kraken does """
+  result = {}
+  for k, v in response['result'].items():
+    if k == 'last':
+      result[k] = v
+    else:
+      result[k] = [row for row in v if row[0] > since]
+  return {'error': response['error'], 'result': result}
+
+class ReplayServer(object):
+  """ Serves canned responses on /0/public/<method> and /0/private/<method>
+
+  responses maps a method name to a list of responses, served in turn and
+  repeating the last one, or to a callable taking the request parameters.
+  Every rate_limit_every-th request gets EAPI:Rate limit exceeded, every
+  http_error_every-th request an HTTP 503, and each response is delayed by
+  latency seconds. OHLC responses honour the since parameter.
+
+  """
+
+  def __init__(self, responses=None, latency=0.0, rate_limit_every=0, http_error_every=0,
+               host='127.0.0.1', port=0):
+    self.responses = dict(responses or {})
+    self.latency = latency
+    self.rate_limit_every = rate_limit_every
+    self.http_error_every = http_error_every
+    self.requests = 0
+    self.served = {}
+    self.lock = threading.Lock()
+    self.httpd = http.server.ThreadingHTTPServer((host, port), self._handler())
+    self.httpd.daemon_threads = True
+    self.thread = None
+
+  @property
+  def address(self):
+    host, port = self.httpd.server_address[:2]
+    return '%s:%d' % (host, port)
+
+  def start(self):
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  def connection(self, size=4):
+    """ A kraken.ConnectionPool pointing at this server """
+    return kraken.ConnectionPool(self.address, size=size, secure=False)
+
+  def respond(self, method, req):
+    """ Returns (HTTP status, response dict) for a request """
+    with self.lock:
+      self.requests += 1
+      n = self.requests
+      served = self.served[method] = self.served.get(method, 0) + 1
+
+    if self.latency:
+      time.sleep(self.latency)
+    if self.http_error_every and n % self.http_error_every == 0:
+      return 503, None
+    if self.rate_limit_every and n % self.rate_limit_every == 0:
+      return 200, RATE_LIMIT
+
+    responses = self.responses.get(method)
+    if responses is None:
+      return 200, {'error': ['EGeneral:Unknown method'], 'result': {}}
+    if callable(responses):
+      return 200, responses(req)
+
+    response = responses[min(served, len(responses)) - 1]
+    if method == 'OHLC' and 'since' in req:
+      response = _since(response, int(req['since']))
+    return 200, response
+
+  def _handler(self):
+    server = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        req = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+
+        status, response = server.respond(path.rsplit('/', 1)[-1], req)
+        body = b'' if response is None else json.dumps(response).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    return Handler
@@ -0,0 +1,131 @@
+import datetime
+
+import numpy as np
+
+import series
+
+from ohlc import OHLC, OHLCRollup
+
+from sqlalchemy import and_, or_
+
+# resample intervals, in minutes, kept as rollup tables
+ROLLUP_INTERVALS = (60, 240, 1440)
+
+BASE_COLUMNS = (OHLC.timestamp, OHLC.open, OHLC.high, OHLC.low,
+                OHLC.close, OHLC.vwap, OHLC.volume, OHLC.count)
+
+ROLLUP_COLUMNS = (OHLCRollup.timestamp, OHLCRollup.open, OHLCRollup.high, OHLCRollup.low,
+                  OHLCRollup.close, OHLCRollup.vwap, OHLCRollup.volume, OHLCRollup.count)
+
+def load_base(session, pair, since, until=None):
+  """ Base bars of pair in [since, until) as a BarSeries """
+  query = session.query(*BASE_COLUMNS).filter( and_( OHLC.pair == pair,
+                                                     OHLC.timestamp >= since ))
+  if until is not None:
+    query = query.filter(OHLC.timestamp < until)
+  return series.BarSeries.from_rows(query.order_by(OHLC.timestamp).all())
+
+def load_base_ranges(session, pair, ranges):
+  """ Base bars of pair in any of the [start, end) epoch ranges (end None for open ended) as a BarSeries """
+  parts = []
+  # bounded, a long list of ranges would hit the bind parameter limits
+  for i in range(0, len(ranges), 100):
+    query = session.query(*BASE_COLUMNS).\
+            filter( and_( OHLC.pair == pair,
+                          within(OHLC.timestamp, ranges[i:i + 100], datetime.datetime.fromtimestamp) ))
+    parts.append(series.BarSeries.from_rows(query.order_by(OHLC.timestamp).all()))
+  return series.concat(parts)
+
+def within(column, ranges, convert=int):
+  """ SQL condition of column falling into any of the [start, end) epoch ranges """
+  return or_(*[column >= convert(start) if end is None else
+               and_( column >= convert(start), column < convert(end) )
+               for start, end in ranges])
+
+def uncovered(timestamps, step, since):
+  """ The [start, end) epoch ranges from since on not covered by rollup buckets starting at the sorted timestamps
+
+  The last range is open ended (end None). These are the ranges to read
+  base bars for: the edge before the first whole bucket, buckets whose
+  rollup was never built, and anything after the last rollup row.
+
+  """
+  timestamps = np.asarray(timestamps, dtype=np.int64)
+  if len(timestamps) == 0:
+    return [(since, None)]
+  # where the coverage of the buckets before each one ends
+  covered = np.maximum(np.r_[since, timestamps[:-1] + step], since)
+  gaps = timestamps > covered
+  ranges = [(int(start), int(end)) for start, end in zip(covered[gaps], timestamps[gaps])]
+  ranges.append((max(since, int(timestamps[-1]) + step), None))
+  return ranges
+
+def load_rollup(session, pair, interval, since):
+  rows = session.query(*ROLLUP_COLUMNS).\
+         filter( and_( OHLCRollup.pair == pair,
+                       OHLCRollup.interval == interval,
+                       OHLCRollup.timestamp >= since )).\
+         order_by(OHLCRollup.timestamp).all()
+  return series.BarSeries.from_rows(rows)
+
+def usable(intervals, base_interval):
+  """ The rollup intervals that aggregate bars of base_interval minutes """
+  return [r for r in intervals if r % base_interval == 0 and r > base_interval]
+
+def closest(interval, intervals):
+  """ The longest rollup interval the given interval is a multiple of, or None """
+  matching = [r for r in intervals if interval % r == 0]
+  if not matching:
+    return None
+  return max(matching)
+
+def update(session, pair, timestamps, intervals=ROLLUP_INTERVALS):
+  """ Re-aggregates the rollup buckets that contain any of the given base bar timestamps
+
+  Returns the number of rollup rows written. The caller commits.
+
+  """
+  written = 0
+  if not timestamps:
+    return written
+  epochs = [int(ts.timestamp()) for ts in timestamps]
+
+  for interval in intervals:
+    step = interval * 60
+    touched = set(ts // step * step for ts in epochs)
+    first = datetime.datetime.fromtimestamp(min(touched))
+    until = datetime.datetime.fromtimestamp(max(touched) + step)
+
+    bars = series.resample(load_base(session, pair, first, until), interval)
+
+    db_rollups = session.query(OHLCRollup).\
+                 filter( and_( OHLCRollup.pair == pair,
+                               OHLCRollup.interval == interval,
+                               OHLCRollup.timestamp >= first,
+                               OHLCRollup.timestamp < until ))
+    existing = dict((db_rollup.timestamp, db_rollup) for db_rollup in db_rollups)
+
+    for bar in bars:
+      if int(bar.timestamp.timestamp()) not in touched:
+        continue
+      db_rollup = existing.get(bar.timestamp)
+      if db_rollup is None:
+        db_rollup = OHLCRollup(pair = pair, interval = interval, timestamp = bar.timestamp)
+        session.add(db_rollup)
+      db_rollup.open = bar.open
+      db_rollup.high = bar.high
+      db_rollup.low = bar.low
+      db_rollup.close = bar.close
+      db_rollup.vwap = bar.vwap
+      db_rollup.volume = bar.volume
+      db_rollup.count = bar.count
+      written += 1
+
+  return written
+
+def rebuild(session, pair, intervals=ROLLUP_INTERVALS, since=None):
+  """ Builds the rollups of pair from the stored base bars, e.g. after enabling them """
+  query = session.query(OHLC.timestamp).filter(OHLC.pair == pair)
+  if since is not None:
+    query = query.filter(OHLC.timestamp >= since)
+  return update(session, pair, [row[0] for row in query], intervals)
@@ -0,0 +1,110 @@
+import collections
+import datetime
+
+import numpy as np
+
+FIELDS = ('timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count')
+
+# One bar of a BarSeries, with the attributes of the OHLC model
+Bar = collections.namedtuple('Bar', FIELDS)
+
+class BarSeries(object):
+  """ Array backed OHLC series, one NumPy column per field
+
+  timestamp holds integer epoch seconds and count integers, the other columns
+  are float64. Indexing with an integer returns a Bar (with a datetime
+  timestamp, like OHLC), slicing returns a BarSeries sharing the columns.
+
+  """
+
+  def __init__(self, timestamp, open, high, low, close, vwap, volume, count):
+    self.timestamp = np.asarray(timestamp, dtype=np.int64)
+    self.open = np.asarray(open, dtype=np.float64)
+    self.high = np.asarray(high, dtype=np.float64)
+    self.low = np.asarray(low, dtype=np.float64)
+    self.close = np.asarray(close, dtype=np.float64)
+    self.vwap = np.asarray(vwap, dtype=np.float64)
+    self.volume = np.asarray(volume, dtype=np.float64)
+    self.count = np.asarray(count, dtype=np.int64)
+
+  @classmethod
+  def from_rows(cls, rows):
+    """ Builds a series from (datetime, open, high, low, close, vwap, volume, count) rows """
+    if len(rows) == 0:
+      return cls.empty()
+    columns = list(zip(*rows))
+    columns[0] = [int(ts.timestamp()) for ts in columns[0]]
+    return cls(*columns)
+
+  @classmethod
+  def empty(cls):
+    return cls(*([[]] * len(FIELDS)))
+
+  def columns(self):
+    return tuple(getattr(self, field) for field in FIELDS)
+
+  def __len__(self):
+    return len(self.timestamp)
+
+  def __getitem__(self, i):
+    if isinstance(i, (slice, np.ndarray)):
+      return BarSeries(*(column[i] for column in self.columns()))
+    return Bar(datetime.datetime.fromtimestamp(int(self.timestamp[i])),
+               float(self.open[i]),
+               float(self.high[i]),
+               float(self.low[i]),
+               float(self.close[i]),
+               float(self.vwap[i]),
+               float(self.volume[i]),
+               int(self.count[i]))
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def rows(self):
+    """ Plain (epoch, open, high, low, close, vwap, volume, count) tuples """
+    return zip(self.timestamp.tolist(), self.open.tolist(), self.high.tolist(), self.low.tolist(),
+               self.close.tolist(), self.vwap.tolist(), self.volume.tolist(), self.count.tolist())
+
+def concat(parts):
+  """ Joins BarSeries end to end """
+  return BarSeries(*(np.concatenate(columns) for columns in zip(*(part.columns() for part in parts))))
+
+def resample(bars, interval):
+  """ Aggregates bars into interval minute buckets, timestamped with the start of the bucket """
+  if len(bars) == 0:
+    return BarSeries.empty()
+
+  if np.any(bars.timestamp[1:] < bars.timestamp[:-1]):
+    order = np.argsort(bars.timestamp, kind='stable')
+    bars = BarSeries(*(column[order] for column in bars.columns()))
+
+  step = int(interval * 60)
+  bucket = bars.timestamp // step * step
+  starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+  return aggregate(bars, starts, bucket[starts])
+
+def aggregate(bars, starts, timestamp):
+  """ Reduces the runs of bars beginning at the starts indices into one bar each
+
+  Open is taken from the first bar of a run, close from the last, high and
+  low are the extremes, VWAP is weighted by volume, volume and count are summed.
+
+  """
+  ends = np.r_[starts[1:], len(bars)] - 1
+
+  volume = np.add.reduceat(bars.volume, starts)
+  weighted = np.add.reduceat(bars.vwap * bars.volume, starts)
+  # buckets without volume fall back to the VWAP of their last bar
+  vwap = bars.vwap[ends].copy()
+  np.divide(weighted, volume, out=vwap, where=volume > 0)
+
+  return BarSeries(timestamp,
+                   bars.open[starts],
+                   np.maximum.reduceat(bars.high, starts),
+                   np.minimum.reduceat(bars.low, starts),
+                   bars.close[ends],
+                   vwap,
+                   volume,
+                   np.add.reduceat(bars.count, starts))
@@ -0,0 +1,48 @@
+import datetime
+import os
+import sys
+
+# the modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import datastore
+
+from ohlc import OHLC
+
+START = datetime.datetime(2017, 8, 10, 20, 0)
+
+@pytest.fixture
+def session():
+  """ A session on a new in-memory SQLite database with all tables """
+  engine = create_engine('sqlite://')
+  datastore.init(engine)
+  session = sessionmaker(bind=engine)()
+  yield session
+  session.close()
+
+@pytest.fixture
+def store_bars(session):
+  """ Stores a random walk of OHLC bars of pair in session and commits
+
+  Called as store_bars(pair, bars, interval, seed, missing, idle): of bars
+  slots of interval minutes from START, a missing fraction has no bar and
+  an idle fraction of the others no trades (count and volume 0).
+
+  """
+  def store(pair, bars, interval=5, seed=0, missing=0.0, idle=0.0):
+    rng = np.random.default_rng(seed)
+    slots = np.flatnonzero(rng.random(bars) >= missing)
+    price = 100 * np.exp(np.cumsum(rng.normal(0, 0.005, len(slots))))
+    trades = np.where(rng.random(len(slots)) < idle, 0, rng.integers(1, 7, len(slots)))
+    for slot, p, count in zip(slots.tolist(), price.tolist(), trades.tolist()):
+      session.add(OHLC(pair = pair, timestamp = START + datetime.timedelta(minutes = interval * slot),
+                       open = p, high = p * 1.01, low = p * 0.99, close = p, vwap = p,
+                       volume = float(count), count = count))
+    session.commit()
+  return store
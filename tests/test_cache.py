@@ -0,0 +1,82 @@
+""" ColumnCache appends and generation swaps """
+
+import os
+
+import numpy as np
+import pytest
+
+import cache
+import series
+
+PAIR = 'XTESTZEUR'
+START = 1502398800
+
+def walk(bars, seed=0, start=START):
+  rng = np.random.default_rng(seed)
+  price = 100 * np.exp(np.cumsum(rng.normal(0, 0.005, bars)))
+  return series.BarSeries(start + np.arange(bars) * 900, price, price * 1.01, price * 0.99, price,
+                          price, rng.random(bars), rng.integers(1, 50, bars))
+
+def revised(bars, factor=1.001):
+  """ The bars with new prices, as a later poll returns them """
+  return series.BarSeries(bars.timestamp, bars.open, bars.high * factor, bars.low, bars.close * factor,
+                          bars.vwap * factor, bars.volume + 1, bars.count + 1)
+
+def generations(column_cache):
+  base = column_cache._dir(PAIR, 15)
+  with open(os.path.join(base, 'CURRENT')) as f:
+    return f.read().strip(), sorted(d for d in os.listdir(base) if d.startswith('g'))
+
+def assert_same(a, b):
+  assert len(a) == len(b)
+  for x, y in zip(a.columns(), b.columns()):
+    assert np.array_equal(x, y)
+
+@pytest.fixture
+def column_cache(tmp_path):
+  return cache.ColumnCache(str(tmp_path))
+
+def test_tail_revisions_append(column_cache):
+  bars = walk(200)
+  column_cache.fill(PAIR, 15, bars[:100])
+  before = generations(column_cache)
+  held = column_cache.open(PAIR, 15)
+  held_vwap = np.array(held.vwap)
+
+  # every poll revises the still open bar and brings the next one
+  for i in range(100, 200):
+    column_cache.fill(PAIR, 15, series.concat([revised(bars[i - 1:i]), bars[i:i + 1]]))
+    latest = column_cache.open(PAIR, 15)
+    assert latest.vwap[i - 1] == revised(bars[i - 1:i]).vwap[0]
+    assert latest.vwap[i] == bars.vwap[i]
+
+  assert generations(column_cache) == before
+  expected = series.concat([bars[:99], revised(bars[99:199]), bars[199:]])
+  assert_same(column_cache.open(PAIR, 15), expected)
+  assert_same(column_cache.bars(PAIR, 15, int(bars.timestamp[150])), expected[150:])
+  assert np.array_equal(held.vwap, held_vwap)
+
+def test_earlier_changes_rewrite(column_cache):
+  bars = walk(100)
+  column_cache.fill(PAIR, 15, bars)
+  held = column_cache.open(PAIR, 15)
+  held_vwap = np.array(held.vwap)
+
+  column_cache.fill(PAIR, 15, revised(bars[50:52]))
+  current, directories = generations(column_cache)
+  assert (current, directories) == ('g2', ['g2'])
+  assert_same(column_cache.open(PAIR, 15), series.concat([bars[:50], revised(bars[50:52]), bars[52:]]))
+  assert np.array_equal(held.vwap, held_vwap)
+
+def test_interrupted_append(column_cache):
+  bars = walk(10)
+  column_cache.fill(PAIR, 15, bars[:5])
+  generation = column_cache._generation(PAIR, 15)
+  # the columns got the revised tail bar and a new one, tail.bin was not replaced yet
+  column_cache._append(generation, series.concat([revised(bars[4:6]), bars[6:7]]))
+  column_cache._write_tail(generation, bars[4:5])
+
+  expected = series.concat([bars[:4], revised(bars[4:6])])
+  assert_same(column_cache.open(PAIR, 15), expected)
+  column_cache.fill(PAIR, 15, bars[6:])
+  assert_same(column_cache.open(PAIR, 15), series.concat([expected, bars[6:]]))
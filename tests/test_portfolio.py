@@ -0,0 +1,56 @@
+""" Portfolio evaluation against evaluating each pair on its own """
+
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import ann
+import backtest
+import compact
+import portfolio
+import v1
+
+from conftest import START
+from ohlc import OHLC
+
+# not in name order, the panel rows follow this list
+PAIRS = ['XZBZEUR', 'XAAZEUR', 'XCCZEUR']
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ann_strategy.pine')
+
+@pytest.fixture(autouse=True)
+def bars(session, store_bars):
+  for j, pair in enumerate(PAIRS):
+    # the later pairs miss more bars, so the panel has holes, and some bars have no trades
+    store_bars(pair, 3000, seed=j, missing=0.05 + 0.3 * j, idle=0.1)
+  # whole hours without trades too, which are not missing either
+  session.query(OHLC).filter(OHLC.timestamp < START + datetime.timedelta(hours=2)).update({'volume': 0, 'count': 0})
+  session.commit()
+
+@pytest.mark.parametrize('interval', [5, 60])
+def test_rows_match_single_pairs(session, interval):
+  model = ann.load(MODEL)
+  panel = portfolio.PortfolioHistory(session, PAIRS, interval, START).panel()
+  signals = portfolio.PortfolioStrategy(panel, model).signals()
+  assert signals.shape == (len(PAIRS), len(panel.timestamp))
+
+  for i, pair in enumerate(PAIRS):
+    bars = v1.TradeHistory(session, pair, interval, START, rollups=()).bars()
+    assert len(bars) > 1
+    assert np.any(bars.count == 0)
+    assert np.array_equal(panel.bars(pair).timestamp, bars.timestamp)
+    for x, y in zip(panel.bars(pair).columns(), bars.columns()):
+      assert np.allclose(x, y)
+
+    expected = ann.positions(backtest.predict(bars, model), model.threshold)
+    assert np.array_equal(signals[i][panel.available[i]], expected)
+
+def test_compact_panel_matches_ohlc(session):
+  store = compact.CompactStore(5, rollups=())
+  compact.migrate(session, store)
+  panel = portfolio.PortfolioHistory(session, PAIRS, 60, START).panel()
+  compact_panel = portfolio.PortfolioHistory(session, PAIRS, 60, START, store=store).panel()
+  assert np.array_equal(compact_panel.timestamp, panel.timestamp)
+  assert np.array_equal(compact_panel.available, panel.available)
+  assert np.allclose(compact_panel.vwap, panel.vwap, equal_nan=True)
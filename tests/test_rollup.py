@@ -0,0 +1,61 @@
+""" Rollup-backed TradeHistory reads against resampling the base bars """
+
+import datetime
+
+import numpy as np
+import pytest
+
+import rollup
+import v1
+
+from conftest import START
+from ohlc import OHLCRollup
+
+PAIR = 'XTESTZEUR'
+
+@pytest.fixture(autouse=True)
+def bars(store_bars):
+  # 15 minute bars with some gaps in the feed and some without trades
+  store_bars(PAIR, 2000, interval=15, missing=0.01, idle=0.05)
+
+def assert_same(a, b):
+  assert len(a) == len(b)
+  for x, y in zip(a.columns(), b.columns()):
+    assert np.allclose(x, y)
+
+def histories(session, base_interval=15):
+  for since in (START, START + datetime.timedelta(hours = 5, minutes = 25), START + datetime.timedelta(days = 9)):
+    for interval in (60, 240, 480, 1440, 45):
+      with_rollups = v1.TradeHistory(session, PAIR, interval, since, base_interval=base_interval).bars()
+      base = v1.TradeHistory(session, PAIR, interval, since, rollups=(), base_interval=base_interval).bars()
+      yield with_rollups, base
+
+def test_rollups_match_base(session):
+  rollup.rebuild(session, PAIR, rollup.usable(rollup.ROLLUP_INTERVALS, 15))
+  session.commit()
+  for with_rollups, base in histories(session):
+    assert len(base) > 0
+    assert_same(with_rollups, base)
+
+def test_missing_rollups_fall_back_to_base(session):
+  # nothing built at all, then only a window in the middle
+  for with_rollups, base in histories(session):
+    assert_same(with_rollups, base)
+
+  rollup.rebuild(session, PAIR, rollup.usable(rollup.ROLLUP_INTERVALS, 15), START + datetime.timedelta(days = 5))
+  session.query(OHLCRollup).filter(OHLCRollup.timestamp >= START + datetime.timedelta(days = 12)).delete()
+  session.query(OHLCRollup).filter(OHLCRollup.timestamp.between(START + datetime.timedelta(days = 7),
+                                                                START + datetime.timedelta(days = 8))).delete()
+  session.commit()
+  for with_rollups, base in histories(session):
+    assert_same(with_rollups, base)
+
+def test_rollup_of_the_base_interval_is_not_read(session):
+  # a 60 minute base has no 60 minute rollup
+  assert rollup.usable(rollup.ROLLUP_INTERVALS, 60) == [240, 1440]
+  assert v1.TradeHistory(session, PAIR, 60, START, base_interval=60).rollup is None
+
+def test_uncovered():
+  assert rollup.uncovered([], 60, 10) == [(10, None)]
+  assert rollup.uncovered([60, 120, 240], 60, 10) == [(10, 60), (180, 240), (300, None)]
+  assert rollup.uncovered([60, 120], 60, 60) == [(180, None)]
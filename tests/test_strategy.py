@@ -0,0 +1,94 @@
+""" ANNStrategy against the decisions of the original hand-written strategy
+
+data/ann_strategy_reference.json holds random walks (newest first) with the
+network output and buying state the 15-30-9-1 formula of the original
+_tick() produced for each bar, before the weights were loaded from Pine.
+
+"""
+
+import collections
+import datetime
+import decimal
+import json
+import os
+import random
+
+import numpy as np
+
+import ann
+import rollup
+import v1
+
+from conftest import START
+
+Tick = collections.namedtuple('Tick', ('timestamp', 'vwap'))
+
+def random_walk(seed, bars, volatility):
+  rng = random.Random(seed)
+  price = 100.0
+  ticks = []
+  for _ in range(bars):
+    price *= 1 + rng.gauss(0, volatility)
+    ticks.append(Tick(datetime.datetime(2020, 1, 1), decimal.Decimal('%.5f' % price)))
+  return ticks
+
+def reference():
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ann_strategy_reference.json')
+  with open(path) as f:
+    for walk in json.load(f):
+      ticks = [Tick(datetime.datetime(2020, 1, 1), decimal.Decimal(vwap)) for vwap in walk['vwap']]
+      yield ticks, np.array(walk['prediction']), np.array(walk['buying'], dtype=bool)
+
+def test_predictions_match_reference():
+  model = ann.load(v1.DEFAULT_MODEL)
+  for ticks, prediction, _ in reference():
+    vwap = [float(tick.vwap) for tick in ticks]
+    assert np.allclose(model.predict(ann.diffs(vwap)[:len(ticks) - 2]), prediction, rtol=0, atol=1e-12)
+
+def test_signals_match_reference():
+  for ticks, _, buying in reference():
+    assert np.array_equal(v1.ANNStrategy(ticks).signals(), buying)
+
+    strategy = v1.ANNStrategy(ticks)
+    for i in range(len(ticks) - 2):
+      strategy._tick(i)
+      assert strategy.buying == buying[i]
+
+def test_signals_continue_from_state():
+  ticks = random_walk(0, 500, 0.02)
+  strategy = v1.ANNStrategy(ticks)
+  strategy.buying = True
+  signals = strategy.signals()
+
+  reference = v1.ANNStrategy(ticks)
+  reference.buying = True
+  for i in range(len(ticks) - 2):
+    reference._tick(i)
+    assert signals[i] == reference.buying
+  assert strategy.buying == reference.buying
+
+def test_stream_catches_up_after_crash(session, store_bars, tmp_path):
+  store_bars('XTESTZEUR', 600, seed=1, idle=0.05)
+  bars = rollup.load_base(session, 'XTESTZEUR', START)
+
+  reference = v1.StreamingANNStrategy('XTESTZEUR', 60)
+  for i in range(0, len(bars), 7):
+    reference.on_bars('XTESTZEUR', bars[i:i + 7])
+
+  checkpoint = str(tmp_path / 'stream.json')
+  strategy = v1.StreamingANNStrategy('XTESTZEUR', 60, checkpoint=checkpoint)
+  for i in range(0, 540, 7):
+    strategy.on_bars('XTESTZEUR', bars[i:i + 7])
+  # bars 539 on were committed, then the process died before they were handed out
+
+  restarted = v1.StreamingANNStrategy('XTESTZEUR', 60, checkpoint=checkpoint)
+  restarted.catch_up(session, START)
+  fresh = v1.StreamingANNStrategy('XTESTZEUR', 60)
+  fresh.catch_up(session, START)
+
+  for caught_up in (restarted, fresh):
+    assert caught_up.prediction is not None
+    assert caught_up.prediction == reference.prediction
+    assert caught_up.buying == reference.buying
+    assert list(caught_up.bars) == list(reference.bars)
+    assert caught_up.open_bars == reference.open_bars
@@ -0,0 +1,68 @@
+""" Incremental syncing from the persisted since cursor, against a replay.ReplayServer """
+
+import os
+
+import pytest
+
+import replay
+import v1
+
+from cursor import SyncCursor
+from ohlc import OHLC
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAIR = 'XETHZEUR'
+
+class RecordingServer(replay.ReplayServer):
+  """ Keeps the parameters of every request """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.seen = []
+
+  def respond(self, method, req):
+    self.seen.append(dict(req))
+    return super().respond(method, req)
+
+class Listener(object):
+
+  def __init__(self):
+    self.calls = []
+
+  def on_bars(self, pair, bars):
+    self.calls.append((pair, bars))
+
+@pytest.fixture
+def server():
+  responses = [replay.load_recorded(os.path.join(ROOT, name)) for name in ('resp1.json', 'resp2.json')]
+  server = RecordingServer({'OHLC': responses}).start()
+  yield server
+  server.stop()
+
+def test_cursor_round_trip(session, server):
+  syncer = v1.TradeHistorySynchronizer([PAIR], 15, api_key='', rollups=(), workers=1)
+  syncer.api.conn = server.connection(size=1)
+  listener = Listener()
+  syncer.listeners.append(listener)
+  try:
+    syncer.sync(session)
+    first = server.responses['OHLC'][0]['result']
+    assert 'since' not in server.seen[0]
+    assert session.query(OHLC).count() == len(first[PAIR])
+    assert session.get(SyncCursor, (PAIR, 15)).last == first['last']
+
+    syncer.sync(session)
+  finally:
+    syncer.api.conn.close()
+
+  second = server.responses['OHLC'][1]['result']
+  assert int(server.seen[1]['since']) == first['last']
+  assert session.query(OHLC).count() == len(first[PAIR])
+
+  # only the still open bar after the cursor came back, revised
+  pair, bars = listener.calls[-1]
+  trailing = second[PAIR][-1]
+  assert pair == PAIR
+  assert bars.timestamp.tolist() == [trailing[0]]
+  assert bars.vwap[0] == pytest.approx(float(trailing[5]))
+  assert bars.count[0] == trailing[7]